@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Build-cost benchmark on synthetic city lists.
+
+  python3 benchmark.py                       # 1k, 10k, 100k cities
+  python3 benchmark.py --sizes 1000 10000 --jobs 8 --out bench.json
+
+For each size a synthetic cities.csv (city,state,col,lat,lon) is written to a temp
+dir and measured in a fresh subprocess (so peak RSS is per size):
+- the full main() pipeline (clean build, then a no-op incremental rebuild)
+- the build's own stages alone: nearby_cities (k-d tree), rendering the city,
+  city cost and home page jobs from site_pages() (nearby links included), and
+  streaming the sitemap through SitemapWriter
+
+Results are printed as JSON: wall seconds, pages/sec, peak RSS and bytes written.
+"""
+
+from __future__ import annotations
+
+from dataclasses import replace
+from pathlib import Path
+import argparse
+import contextlib
+import csv
+import io
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+STATES = (
+  "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "FL", "GA", "HI", "ID", "IL", "IN", "IA", "KS",
+  "KY", "LA", "ME", "MD", "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH", "NJ", "NM", "NY",
+  "NC", "ND", "OH", "OK", "OR", "PA", "RI", "SC", "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV",
+  "WI", "WY",
+)
+
+
+def write_synthetic_csv(path: Path, count: int, *, seed: int = 0) -> None:
+  rng = random.Random(seed)
+  with path.open("w", newline="", encoding="utf-8") as f:
+    writer = csv.writer(f)
+    writer.writerow(["city", "state", "col", "lat", "lon"])
+    for i in range(count):
+      writer.writerow([
+        f"Synthville {i}", STATES[i % len(STATES)], f"{rng.uniform(0.8, 1.3):.2f}",
+        f"{rng.uniform(25.0, 49.0):.4f}", f"{rng.uniform(-124.0, -67.0):.4f}",
+      ])
+
+
+def peak_rss_bytes() -> int:
+  # ru_maxrss is KiB on Linux, bytes on macOS.
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return rss if sys.platform == "darwin" else rss * 1024
+
+
+def tree_bytes(root: Path) -> int:
+  return sum(p.stat().st_size for p in root.rglob("*") if p.is_file())
+
+
+def timed(fn, *args) -> float:
+  start = time.perf_counter()
+  fn(*args)
+  return time.perf_counter() - start
+
+
+def run_main(argv: list[str]) -> float:
+  with contextlib.redirect_stdout(io.StringIO()):
+    return timed(generate.main, argv)
+
+
+def measure(count: int, jobs: int) -> dict[str, object]:
+  """
+  Runs inside the per-size subprocess.
+  """
+  with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+    tmp_dir = Path(tmp)
+    csv_path = tmp_dir / "cities.csv"
+    write_synthetic_csv(csv_path, count)
+
+    config = replace(
+      generate.CONFIG,
+      cities_csv=csv_path,
+      output_dir=tmp_dir / "public",
+      manifest_path=tmp_dir / "manifest.json",
+      wrangler_path=tmp_dir / "wrangler.jsonc",
+      vercel_path=tmp_dir / "vercel.json",
+      cloudflare_rules_path=tmp_dir / "cloudflare-redirects.json",
+    )
+    cities = generate.load_cities_from_csv(csv_path)
+    generate.set_site(config, cities)
+    pages = len(generate.site_pages(cities))
+
+    argv = ["--jobs", str(jobs)]
+    full = run_main(["--full", *argv])
+    written = tree_bytes(config.output_dir)
+    noop = run_main(argv)
+
+    start = time.perf_counter()
+    nearby = generate.nearby_cities(cities, config.nearby_count)[0]
+    stages = {"nearby_cities": (time.perf_counter() - start, len(cities))}
+    page_jobs = generate.site_pages(cities, nearby)
+    for kind in ("city", "city_cost", "home"):
+      kind_jobs = [job for job in page_jobs if job.kind == kind]
+      stages[f"{kind}_pages"] = (timed(lambda: [job.render() for job in kind_jobs]), len(kind_jobs))
+
+    listed = [job for job in page_jobs if job.kind not in generate.SITEMAP_EXCLUDED_KINDS]
+    build = generate.IncrementalBuild(tmp_dir / "sitemap", tmp_dir / "sitemap.json", full=True)
+
+    def write_sitemap() -> None:
+      sitemap = generate.SitemapWriter(build)
+      for job in listed:
+        sitemap.add(job.url, build.build_date)
+      sitemap.close()
+
+    stages["sitemap"] = (timed(write_sitemap), len(listed))
+
+  return {
+    "cities": count,
+    "pages": pages,
+    "jobs": jobs,
+    "main": {
+      "wall_s": round(full, 4),
+      "pages_per_s": round(pages / full, 1),
+      "bytes_written": written,
+      "noop_rebuild_s": round(noop, 4),
+    },
+    "stages": {
+      name: {"wall_s": round(wall, 4), "calls": calls, "per_s": round(calls / wall, 1) if wall else None}
+      for name, (wall, calls) in stages.items()
+    },
+    "peak_rss_bytes": peak_rss_bytes(),
+  }
+
+
+def main(argv: list[str] | None = None) -> None:
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), metavar="N")
+  parser.add_argument("--jobs", type=int, default=1, help="passed to generate.py --jobs")
+  parser.add_argument("--out", type=Path, help="also write the JSON report to this file")
+  parser.add_argument("--measure", type=int, help=argparse.SUPPRESS)  # internal: one size, in-process
+  args = parser.parse_args(argv)
+
+  if args.measure is not None:
+    print(json.dumps(measure(args.measure, args.jobs)))
+    return
+
+  results = []
+  for count in args.sizes:
+    proc = subprocess.run(
+      [sys.executable, __file__, "--measure", str(count), "--jobs", str(args.jobs)],
+      check=True,
+      capture_output=True,
+      text=True,
+    )
+    results.append(json.loads(proc.stdout))
+    print(f"✅ {count} cities: {results[-1]['main']['wall_s']}s", file=sys.stderr)
+
+  report = json.dumps({"python": sys.version.split()[0], "results": results}, indent=2)
+  if args.out:
+    args.out.write_text(report + "\n", encoding="utf-8")
+  print(report)
+
+
+if __name__ == "__main__":
+  main()
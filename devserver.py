@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Local dev server for the generated site.
+
+  python3 devserver.py                          # build, serve :8000, rebuild on save
+  python3 devserver.py --port 9000 --external-css --compress
+  curl -H "Host: chicago-il.localhost:8000" http://127.0.0.1:8000/cost/
+
+Serving mirrors production:
+- Host routing as in vercel.json: www.<apex> and apex /<slug>/... answer 308
+  to the apex and the city subdomain; <slug>.<SUBDOMAIN_BASE> (or
+  <slug>.localhost, which browsers resolve to 127.0.0.1) serves /<slug>/...
+- Precompressed .br/.gz siblings (--compress) are served when accepted.
+- /assets/* is immutable; everything else must revalidate (production pages
+  get a short TTL instead, see vercel.json / _headers).
+
+cities.csv, picture.png and generate.py are polled; a change runs an
+incremental build in-process (a change to generate.py or the image reloads
+the module first, dropping its cached layouts), so only pages whose inputs
+changed are re-rendered, and --in-place skips the staging copy so the cost
+is O(changed files). Unknown options are passed to generate.py.
+"""
+
+from __future__ import annotations
+
+from email.utils import formatdate
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+import argparse
+import importlib
+import threading
+import time
+import traceback
+
+import generate
+
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))  # preference order
+
+
+class Rebuilder:
+  """
+  Polls the build inputs and reruns generate.main() when one changes.
+  """
+
+  def __init__(self, build_argv: list[str], *, interval: float = 0.2) -> None:
+    self.build_argv = build_argv
+    self.interval = interval
+    self.lock = threading.Lock()  # one build at a time
+    self.config = generate.CONFIG
+    self.slug_re = generate.city_slug_re(self.config.load_cities())  # apex /<slug>/ redirects
+    self.stamps = self.snapshot()
+
+  def snapshot(self) -> dict[Path, tuple[int, int] | None]:
+    stamps = {}
+    for path in generate.input_paths():
+      try:
+        st = path.stat()
+        stamps[path] = (st.st_mtime_ns, st.st_size)
+      except FileNotFoundError:
+        stamps[path] = None
+    return stamps
+
+  def build(self, *, reload: bool = False) -> None:
+    with self.lock:
+      start = time.perf_counter()
+      try:
+        if reload:
+          importlib.reload(generate)
+          self.config = generate.CONFIG
+        # main() applies CLI overrides to CONFIG; start every build from the base.
+        with generate.site_context(self.config):
+          generate.main(self.build_argv)
+          self.slug_re = generate.city_slug_re(generate.get_cities())
+      except Exception:
+        traceback.print_exc()
+        print("❌ Build failed; still serving the previous output")
+        return
+      print(f"✅ Rebuilt in {time.perf_counter() - start:.2f}s")
+
+  def watch(self) -> None:
+    source = Path(generate.__file__).resolve()
+    while True:
+      time.sleep(self.interval)
+      stamps = self.snapshot()
+      changed = [path for path in stamps if stamps[path] != self.stamps.get(path)]
+      if not changed:
+        continue
+      self.stamps = stamps
+      print("🔁 Changed: " + ", ".join(path.name for path in changed))
+      # Reload for the image too: layouts cache its size and derivatives.
+      self.build(reload=source in changed or generate.source_image_path() in changed)
+
+
+class DevHandler(BaseHTTPRequestHandler):
+  server_version = "devserver"
+  rebuilder: Rebuilder
+
+  def do_GET(self) -> None:
+    self.serve(head=False)
+
+  def do_HEAD(self) -> None:
+    self.serve(head=True)
+
+  def serve(self, *, head: bool) -> None:
+    config = self.rebuilder.config
+    host = self.headers.get("Host", "")
+    location = generate.host_redirect(
+      host, self.path, self.rebuilder.slug_re, config.site_origin, config.subdomain_base
+    )
+    if location is not None:
+      return self.redirect(location)
+    url_path = unquote(urlsplit(self.path).path)
+    path = generate.route_host(host, url_path, config.subdomain_base)
+    rel = generate.tree_path(path)
+
+    root = config.output_dir.resolve()
+    target = root / rel
+    if not url_path.endswith("/") and (target / "index.html").is_file():
+      return self.redirect(url_path + "/")
+    if not target.is_file():
+      return self.send_error(HTTPStatus.NOT_FOUND)
+
+    encoding = None
+    accepted = generate.accepted_encodings(self.headers.get("Accept-Encoding", ""))
+    for name, suffix in ENCODINGS:
+      variant = target.with_name(target.name + suffix)
+      if name in accepted and variant.is_file():
+        encoding, target = name, variant
+        break
+
+    data = target.read_bytes()
+    self.send_response(HTTPStatus.OK)
+    self.send_header("Content-Type", generate.content_type(rel))
+    self.send_header("Content-Length", str(len(data)))
+    self.send_header("Last-Modified", formatdate(target.stat().st_mtime, usegmt=True))
+    self.send_header("Vary", "Accept-Encoding")
+    if encoding:
+      self.send_header("Content-Encoding", encoding)
+    cache = generate.cache_control(rel) if rel.startswith("assets/") else generate.REVALIDATE_CACHE_CONTROL
+    self.send_header("Cache-Control", cache)
+    self.end_headers()
+    if not head:
+      self.wfile.write(data)
+
+  def redirect(self, location: str) -> None:
+    self.send_response(HTTPStatus.PERMANENT_REDIRECT)
+    self.send_header("Location", location)
+    self.send_header("Content-Length", "0")
+    self.end_headers()
+
+
+def main(argv: list[str] | None = None) -> None:
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8000)
+  parser.add_argument("--no-build", action="store_true", help="serve the existing output without building first")
+  parser.add_argument("--no-watch", action="store_true", help="do not rebuild when inputs change")
+  args, build_argv = parser.parse_known_args(argv)
+
+  rebuilder = Rebuilder(["--in-place", *build_argv])
+  if not args.no_build:
+    rebuilder.build()
+  if not args.no_watch:
+    threading.Thread(target=rebuilder.watch, daemon=True).start()
+
+  DevHandler.rebuilder = rebuilder
+  httpd = ThreadingHTTPServer((args.host, args.port), DevHandler)
+  print(f"✅ Serving {rebuilder.config.output_dir.resolve()} on http://{args.host}:{args.port}/")
+  print(f"✅ City pages: http://<slug>.localhost:{args.port}/ (or Host: <slug>.{rebuilder.config.subdomain_base})")
+  try:
+    httpd.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    httpd.server_close()
+
+
+if __name__ == "__main__":
+  main()
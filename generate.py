@@ -4,15 +4,104 @@ Static site generator (no JS) for a single-service, multi-city site.
 
 ✅ Local:
   python3 generate.py
-  python3 -m http.server 8000 --directory public
+  python3 devserver.py  # subdomain routing like vercel.json, rebuilds on save
+
+Incremental, staged builds:
+- Each run builds into public.staging/ and swaps it over public/ at the end,
+  so public/ is never half-written. Pages whose input hashes match
+  .build-manifest.json are hard-linked from the live build instead of being
+  re-rendered; pages for removed cities are simply not carried over. The
+  swapped-out build stays in public.staging/ as the next run's starting
+  point, so a rebuild only touches the files that changed.
+- python3 generate.py --full  forces a clean rebuild.
+- python3 generate.py --keep-previous  keeps the replaced build in public.prev/;
+  python3 generate.py --rollback  swaps it back.
+- python3 generate.py --jobs 16  renders pages across 16 worker processes
+  (output is byte-identical to the serial build).
+- python3 generate.py --in-place  updates public/ directly (no staging/swap),
+  so a rebuild only touches changed files; used by devserver.py.
+
+Shared stylesheet:
+- python3 generate.py --external-css  writes /assets/site.<hash>.css once and
+  links it (absolute apex URL) from every page; /assets/* is served immutable.
+- python3 generate.py --prune-css  instead inlines, per page, only the rules
+  its HTML can match (e.g. no contact-form CSS on city pages).
+- python3 generate.py --minify  collapses insignificant whitespace, strips CSS
+  comments and shortens tags/attributes in one linear pass per page; pages
+  render identically (<script>/<pre>/<textarea> bodies are left untouched).
+
+Responsive images (needs Pillow: pip install pillow):
+- python3 generate.py --responsive-images  writes AVIF/WebP/JPEG derivatives of
+  picture.png to /assets/ and serves them via <picture>/srcset. Derivatives are
+  cached in .build-cache/images/ and only re-encoded when the source changes.
+- The image opens every page's main card, so it is the LCP element: it loads
+  eagerly with fetchpriority="high", is preloaded from <head>, and carries
+  width/height read from the PNG header (no layout shift).
+
+Contact form:
+- python3 generate.py --networx-facade  replaces the contact page's blocking
+  Networx <script> with a same-size placeholder; the form loads from
+  /contact/form/ in an iframe on click (plain link without JS).
+
+Precompression (brotli optional: pip install brotli):
+- python3 generate.py --compress  writes index.html.gz/.br (and .xml/.css/.txt)
+  siblings at maximum compression; only changed files are recompressed.
+
+Library use (no import-time I/O; cities load lazily):
+  import generate
+  files = generate.build_site(config, cities)  # {"index.html": b"...", ...}
+  generate.build_site(config, sink=generate.ArchiveSink(Path("site.zip")))
+
+Deployment bundle:
+- python3 generate.py --bundle site.tar.gz  streams every file into one archive
+  (fixed timestamps, build order, bundle-manifest.json of sha256 hashes last)
+  instead of writing public/.
+- python3 generate.py --bundle site.pack --compress  writes one indexed pack of
+  ready-made HTTP responses instead; python3 packserver.py site.pack serves it
+  (mmap + sendfile, same host routing as vercel.json).
+
+Reproducible builds:
+- Every output byte depends only on the inputs plus the build date, which
+  --build-date YYYY-MM-DD (or "auto": last git change to cities.csv, the image
+  or generate.py) or SOURCE_DATE_EPOCH pins; otherwise it is today.
+- python3 generate.py --build-date auto --verify-reproducible  runs two --full
+  builds into temporary dirs and fails on any difference in the output tree,
+  wrangler.jsonc or the host configs.
+
+Deploy delta:
+- python3 generate.py --deploy-delta delta.json  lists files added/changed/removed
+  since the last deploy, plus the canonical URLs of those pages.
+- python3 generate.py --mark-deployed  (after a successful upload) records the
+  last build as deployed in .deploy-manifest.json.
+
+Profiling:
+- python3 generate.py --profile  prints per-stage wall time / peak memory and
+  page render vs write time; --profile-out build.prof adds a cProfile dump.
 
 ✅ Vercel (pure static):
   - Build command: python3 generate.py
   - Output directory: public
 
+Host config (rewritten on every build from the city list, never by hand):
+- vercel.json: /assets/* immutable, pages short TTL + stale-while-revalidate,
+  www -> apex and apex /<slug>/ -> city subdomain redirects, subdomain rewrite.
+- public/_headers (only with --cloudflare-headers, since Vercel would publish
+  it): the same cache policy for Cloudflare static assets.
+- cloudflare-redirects.json: the same two host-based 308 redirects as
+  Cloudflare Single Redirect rules (PUT to the zone's
+  http_request_dynamic_redirect phase entrypoint).
+The build prints a warning whenever vercel.json or the Cloudflare rules
+change: Vercel only sees the committed vercel.json.
+
 Subdomain mo de:
 - City pages are served via host-based rewrites (vercel.json).
 - Therefore city LINKS must be absolute subdomain URLs, not /<slug>/ paths.
+- Optional lat,lon columns in cities.csv add "nearby cities" links (K nearest,
+  SiteConfig.nearby_count) to city pages, via a k-d tree built once per build;
+  the lists are cached in .build-manifest.json and only recomputed for cities
+  near a change.
+- The homepage links to state hubs (/states/<st>/ on the apex), which list
+  their cities and paginate above SiteConfig.state_page_size.
 
 ENV VARS (optional):
   SITE_ORIGIN="https://woodpeckerdamagerepairspecialists.com"
@@ -21,14 +110,49 @@ ENV VARS (optional):
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from functools import cache, lru_cache, wraps
 from pathlib import Path
-from datetime import date
+from datetime import date, datetime, timezone
+import argparse
+import cProfile
 import csv
+import ctypes
+import errno
+import gzip
+import hashlib
+import heapq
 import html
+import io
+import json
+import math
+import mmap
 import os
+import posixpath
 import re
 import shutil
+import struct
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+
+try:  # optional: only needed for --responsive-images
+  from PIL import Image
+except ImportError:
+  Image = None
+
+try:  # optional: only needed for .br siblings with --compress
+  import brotli
+except ImportError:
+  brotli = None
 
 
 # -----------------------
@@ -40,7 +164,7 @@ class SiteConfig:
   cities_csv: Path = Path("cities.csv")
 
   def load_cities(self):
-    return load_cities_from_csv(self.cities_csv)
+    return load_cities_from_csv(self.cities_csv, self)
 
   # Brand / site identity
   base_name: str = "Woodpecker Damage Repair"
@@ -50,16 +174,45 @@ class SiteConfig:
 
   # Build / assets
   output_dir: Path = Path("public")
+  manifest_path: Path = Path(".build-manifest.json")  # input/output hashes of the last build
+  wrangler_path: Path = Path(__file__).resolve().parent / "wrangler.jsonc"
+  vercel_path: Path = Path(__file__).resolve().parent / "vercel.json"
+  cloudflare_rules_path: Path = Path(__file__).resolve().parent / "cloudflare-redirects.json"
+  deploy_manifest_path: Path = Path(".deploy-manifest.json")  # file hashes of the last deploy
+  build_date: str | None = None  # YYYY-MM-DD stamped into sitemap/wrangler; None = today
+
+  def build_day(self) -> str:
+    return self.build_date or date.today().isoformat()
+  external_css: bool = False  # True: link /assets/site.<hash>.css instead of inlining CSS
+  prune_css: bool = False  # True: each page inlines only the CSS rules its HTML can match
+  minify: bool = False  # True: collapse whitespace, strip CSS comments, shorten tags/attributes
+  page_cache_control: str = "public, max-age=300, stale-while-revalidate=86400"  # all but /assets/*
+  cloudflare_headers: bool = False  # True: write output_dir/_headers (Vercel would publish it as a file)
+
+  # Responsive image derivatives (needs Pillow; falls back to the original image)
+  responsive_images: bool = False
+  image_widths: tuple[int, ...] = (480, 800, 1200, 1600)
+  image_formats: tuple[str, ...] = ("avif", "webp", "jpeg")  # preference order, jpeg = <img> fallback
+  image_sizes: str = "(min-width: 900px) 490px, 100vw"  # matches .img (50% of main on desktop)
+  image_cache_dir: Path = Path(".build-cache/images")  # derivatives reused between builds
   image_filename: str = "picture.png"  # sits next to generate.py
 
   # ✅ Root origin + subdomain base (overridable by env vars)
   site_origin: str = os.getenv("SITE_ORIGIN", "https://woodpeckerdamagerepairspecialists.com")
   subdomain_base: str = os.getenv("SUBDOMAIN_BASE", "woodpeckerdamagerepairspecialists.com")
 
+  # Contact form: False embeds the Networx script directly; True renders a
+  # static placeholder that loads /contact/form/ in an iframe on click or
+  # when scrolled into view (and links there without JS)
+  networx_facade: bool = False
+
   # Pricing (base range; city pages may apply multipliers)
   cost_low: int = 350
   cost_high: int = 1500
 
+  # Homepage -> /states/<st>/ hubs -> cities; hubs paginate above this many cities
+  state_page_size: int = 100
+
   # Page H1 titles
   h1_title: str = "Woodpecker Damage Repair/Woodpecker Hole Repair/Siding Repair Services"
   h1_short: str = "Woodpecker Damage Repair Services"
@@ -143,6 +296,10 @@ class SiteConfig:
     "For a clearer breakdown of what affects pricing, you can {view our woodpecker damage repair cost guide}."
   )
 
+  # NEARBY CITIES (needs optional lat/lon columns in cities.csv)
+  nearby_count: int = 6  # K nearest served cities linked from each city page; 0 = off
+  nearby_h2: str = "Woodpecker Damage Repair in Nearby Cities"
+
   # IMAGES
   image_prompt: str = (
     "A realistic natural-light photo of a home exterior repair in progress: a real human contractor on a ladder "
@@ -154,11 +311,68 @@ class SiteConfig:
 
 CONFIG = SiteConfig()
 
-CityWithCol = tuple[str, str, float]
+class City:
+  """
+  One cities.csv row plus everything derived from it (slug, subdomain URL,
+  escaped label, price range), computed once at load time for `config`.
+  Unpacks like the old (city, state, col) tuples.
+  """
 
+  __slots__ = (
+    "name", "state", "col", "lat", "lon", "slug", "url", "label", "label_html", "cost_lo", "cost_hi", "basis"
+  )
 
-def load_cities_from_csv(path: Path) -> tuple[CityWithCol, ...]:
-  cities: list[CityWithCol] = []
+  def __init__(
+    self,
+    name: str,
+    state: str,
+    col: float,
+    config: SiteConfig | None = None,
+    lat: float | None = None,
+    lon: float | None = None,
+  ) -> None:
+    config = config or CONFIG
+    self.name = name
+    self.state = state
+    self.col = col
+    self.lat = lat
+    self.lon = lon
+    self.slug = city_state_slug(name, state)
+    self.url = subdomain_url(self.slug, config)
+    self.label = f"{name}, {state}"
+    self.label_html = esc(self.label)
+    self.cost_lo = f"${int(config.cost_low * col)}"
+    self.cost_hi = f"${int(config.cost_high * col)}"
+    self.basis = City.basis_of(config)
+
+  @staticmethod
+  def basis_of(config: SiteConfig) -> tuple:
+    """
+    The config fields the derived url and prices depend on.
+    """
+    return (config.subdomain_base, config.cost_low, config.cost_high)
+
+  def row(self) -> tuple[str, str, float]:
+    return (self.name, self.state, self.col)
+
+  def for_config(self, config: SiteConfig) -> "City":
+    """
+    This city with its URL and prices derived from `config`: self when it was
+    derived from the same fields, otherwise a fresh record.
+    """
+    if self.basis == City.basis_of(config):
+      return self
+    return City(self.name, self.state, self.col, config, self.lat, self.lon)
+
+  def __iter__(self):
+    return iter(self.row())
+
+  def __repr__(self) -> str:
+    return f"City({self.name!r}, {self.state!r}, {self.col!r})"
+
+
+def load_cities_from_csv(path: Path, config: SiteConfig | None = None) -> tuple[City, ...]:
+  cities: list[City] = []
 
   with path.open(newline="", encoding="utf-8") as f:
     reader = csv.DictReader(f)
@@ -185,12 +399,56 @@ def load_cities_from_csv(path: Path) -> tuple[CityWithCol, ...]:
           f"Invalid col value at CSV line {i}: {col_raw!r}"
         ) from e
 
-      cities.append((city, state, col))
+      # Optional coordinates (for nearby-city links): both or neither.
+      lat_raw = (row.get("lat") or "").strip()
+      lon_raw = (row.get("lon") or "").strip()
+      lat = lon = None
+      if lat_raw or lon_raw:
+        try:
+          lat, lon = float(lat_raw), float(lon_raw)
+        except ValueError as e:
+          raise ValueError(
+            f"Invalid lat/lon at CSV line {i}: {lat_raw!r}, {lon_raw!r}"
+          ) from e
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+          raise ValueError(f"lat/lon out of range at CSV line {i}: {lat}, {lon}")
+
+      cities.append(City(city, state, col, config, lat, lon))
 
   return tuple(cities)
 
 
-CITIES: tuple[CityWithCol, ...] = CONFIG.load_cities()
+_CITIES: tuple[City, ...] | None = None  # see get_cities()
+
+
+def get_cities() -> tuple[City, ...]:
+  """
+  The active city list, read from CONFIG.cities_csv on first use so that
+  importing this module does no I/O.
+  """
+  global _CITIES
+  if _CITIES is None:
+    _CITIES = CONFIG.load_cities()
+  return _CITIES
+
+
+def set_site(config: SiteConfig, cities: tuple[City, ...] | None = None) -> None:
+  """
+  Swap the module-level CONFIG and city list (CLI overrides, library builds,
+  pool workers: spawned workers re-import this module and must see the
+  parent's data). cities=None loads config.cities_csv lazily. Cities loaded
+  under another config are re-derived, so their URLs and prices never go stale.
+  """
+  global CONFIG, _CITIES
+  CONFIG = config
+  _CITIES = None if cities is None else tuple(city.for_config(config) for city in cities)
+
+
+def __getattr__(name: str):
+  # `generate.CITIES` keeps working, resolved lazily.
+  if name == "CITIES":
+    return get_cities()
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # -----------------------
@@ -226,6 +484,63 @@ def city_cost_title(city: str, state: str) -> str:
   return clamp_title(f"{CONFIG.cost_title} in {city}, {state}", 70)
 
 
+STATE_NAMES = {
+  "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas", "CA": "California",
+  "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware", "DC": "District of Columbia",
+  "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho", "IL": "Illinois",
+  "IN": "Indiana", "IA": "Iowa", "KS": "Kansas", "KY": "Kentucky", "LA": "Louisiana",
+  "ME": "Maine", "MD": "Maryland", "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota",
+  "MS": "Mississippi", "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+  "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+  "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma", "OR": "Oregon",
+  "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina", "SD": "South Dakota",
+  "TN": "Tennessee", "TX": "Texas", "UT": "Utah", "VT": "Vermont", "VA": "Virginia",
+  "WA": "Washington", "WV": "West Virginia", "WI": "Wisconsin", "WY": "Wyoming",
+  "PR": "Puerto Rico",
+}
+
+
+def state_name(state: str) -> str:
+  return STATE_NAMES.get(state, state)
+
+
+def state_title(state: str) -> str:
+  return clamp_title(f"{CONFIG.h1_short} in {state_name(state)}", 70)
+
+
+def state_url(state: str, page: int = 1) -> str:
+  """
+  Absolute URL of a state hub page (apex): /states/<st>/, then /states/<st>/page/N/.
+  """
+  path = f"/states/{slugify(state)}/"
+  return root_url(path if page == 1 else f"{path}page/{page}/")
+
+
+def cities_by_state(cities: tuple[City, ...]) -> list[tuple[str, tuple[City, ...]]]:
+  """
+  (state, its cities in CSV order), ordered by state name.
+  """
+  groups: dict[str, list[City]] = {}
+  for c in cities:
+    groups.setdefault(c.state, []).append(c)
+  return [(state, tuple(groups[state])) for state in sorted(groups, key=lambda st: (state_name(st), st))]
+
+
+def digest(*parts: object) -> str:
+  """
+  Stable sha256 over JSON-serialisable parts (tuples/lists/dicts/Paths).
+  """
+  h = hashlib.sha256()
+  for part in parts:
+    h.update(json.dumps(part, sort_keys=True, default=str, ensure_ascii=False).encode("utf-8"))
+    h.update(b"\0")
+  return h.hexdigest()
+
+
+def file_digest(path: Path) -> str:
+  return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
 def write_text(out_path: Path, content: str) -> None:
   out_path.parent.mkdir(parents=True, exist_ok=True)
   out_path.write_text(content, encoding="utf-8")
@@ -237,13 +552,6 @@ def reset_output_dir(p: Path) -> None:
   p.mkdir(parents=True, exist_ok=True)
 
 
-def copy_site_image(*, src_dir: Path, out_dir: Path, filename: str) -> None:
-  src = src_dir / filename
-  if not src.exists():
-    raise FileNotFoundError(f"Missing image next to generate.py: {src}")
-  shutil.copyfile(src, out_dir / filename)
-
-
 def root_url(path: str) -> str:
   """
   Absolute URL for root-site pages (/, /cost/, /how-to/, /contact/).
@@ -252,13 +560,12 @@ def root_url(path: str) -> str:
   return CONFIG.site_origin.rstrip("/") + path
 
 
-def city_url(city: str, state: str) -> str:
+def subdomain_url(slug: str, config: SiteConfig | None = None) -> str:
   """
   Absolute URL for a city subdomain homepage:
   https://<slug>.<SUBDOMAIN_BASE>/
   """
-  slug = city_state_slug(city, state)
-  base = CONFIG.subdomain_base.strip().lstrip(".")
+  base = (config or CONFIG).subdomain_base.strip().lstrip(".")
   return f"https://{slug}.{base}/"
 
 
@@ -638,6 +945,501 @@ footer{
 """.strip()
 
 
+@cache
+def css_asset_path(css: str) -> str:
+  """
+  Content-hashed stylesheet path (relative to output_dir), safe to cache forever.
+  """
+  return f"assets/site.{hashlib.sha256(css.encode('utf-8')).hexdigest()[:12]}.css"
+
+
+def inline_style(css: str) -> str:
+  return f"<style>\n{css}\n  </style>"
+
+
+def stylesheet_html() -> str:
+  if CONFIG.external_css:
+    # Absolute apex URL: one cache entry shared by the apex and every city subdomain.
+    return f'<link rel="stylesheet" href="{esc(root_url(css_asset_path(site_css())))}" />'
+  return inline_style(CSS)
+
+
+# -----------------------
+# CSS PRUNING (--prune-css)
+# -----------------------
+# Elements created at runtime by third-party scripts (Networx form iframe):
+# never in the static HTML, but their rules must survive pruning.
+CSS_DYNAMIC_TOKENS = frozenset({"iframe"})
+
+_HTML_TAG_RE = re.compile(r"<([a-zA-Z][a-zA-Z0-9-]*)")
+_HTML_ATTR_RE = re.compile(r"""\s(class|id)\s*=\s*["']([^"']*)["']""")
+_SELECTOR_NOISE_RE = re.compile(r"\[[^\]]*\]|::?[a-zA-Z-]+(\([^)]*\))?")
+_SELECTOR_TOKEN_RE = re.compile(r"([.#]?)(-?[_a-zA-Z][\w-]*)")
+
+
+def page_tokens(page: str) -> frozenset[str]:
+  """
+  Tag names, .classes and #ids used in an HTML document.
+  """
+  tokens = {tag.lower() for tag in _HTML_TAG_RE.findall(page)}
+  for attr, value in _HTML_ATTR_RE.findall(page):
+    if attr == "class":
+      tokens.update("." + name for name in value.split())
+    else:
+      tokens.add("#" + value.strip())
+  return frozenset(tokens)
+
+
+def selector_tokens(selector: str) -> set[str]:
+  """
+  Tags/.classes/#ids an element matching `selector` needs to exist;
+  attribute selectors and pseudo-classes only narrow the match, so are ignored.
+  """
+  selector = _SELECTOR_NOISE_RE.sub("", selector)
+  return {prefix + name if prefix else name.lower() for prefix, name in _SELECTOR_TOKEN_RE.findall(selector)}
+
+
+def parse_css(css: str) -> list[tuple[str, str | list]]:
+  """
+  Top-level blocks as (prelude, body text) for rules and (@prelude, nested
+  blocks) for at-rules with a block. Linear scan; comments are dropped.
+  """
+  css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+
+  def blocks(start: int, end: int) -> list[tuple[str, str | list]]:
+    out = []
+    i = start
+    while i < end:
+      open_at = css.find("{", i, end)
+      if open_at < 0:
+        break
+      depth, j = 1, open_at + 1
+      while depth and j < end:
+        depth += {"{": 1, "}": -1}.get(css[j], 0)
+        j += 1
+      prelude = css[i:open_at].strip()
+      if prelude.startswith("@media") or prelude.startswith("@supports"):
+        out.append((prelude, blocks(open_at + 1, j - 1)))
+      else:
+        out.append((prelude, css[open_at + 1:j - 1].strip()))
+      i = j
+    return out
+
+  return blocks(0, len(css))
+
+
+def css_block_used(prelude: str, tokens: frozenset[str]) -> bool:
+  if prelude.startswith("@"):  # @font-face, @keyframes, ...: keep
+    return True
+  return any(selector_tokens(sel) <= tokens for sel in prelude.split(","))
+
+
+def render_css(blocks: list[tuple[str, str | list]], tokens: frozenset[str]) -> str:
+  parts = []
+  for prelude, body in blocks:
+    if isinstance(body, list):
+      inner = render_css(body, tokens)
+      if inner:
+        parts.append(f"{prelude}{{\n{inner}\n}}")
+    elif css_block_used(prelude, tokens):
+      parts.append(f"{prelude}{{{body}}}")
+  return "\n".join(parts)
+
+
+@lru_cache(maxsize=64)
+def pruned_css(css: str, tokens: frozenset[str]) -> str:
+  """
+  `css` minus every rule no element in `tokens` can match. Cached by the
+  stylesheet and token set, so each page type is pruned once per process.
+  """
+  return render_css(parse_css(css), tokens | CSS_DYNAMIC_TOKENS)
+
+
+def prune_page_css(page: str) -> str:
+  """
+  Swap the inlined site stylesheet for the rules this page actually uses.
+  """
+  full = inline_style(CSS)
+  start = page.find(full)
+  if start < 0:
+    return page
+  rest = page[:start] + page[start + len(full):]
+  css = pruned_css(CSS, page_tokens(rest))
+  return page[:start] + inline_style(css) + page[start + len(full):]
+
+
+def css_savings(jobs) -> dict[str, tuple[int, int]]:
+  """
+  {page kind: (full, pruned) inline CSS bytes}, measured on each kind's first page.
+  """
+  sizes, seen = {}, set()
+  for job in jobs:
+    if job.kind not in seen:
+      seen.add(job.kind)
+      page = PAGE_RENDERERS[job.kind](*job.args)
+      if inline_style(CSS) in page:  # standalone pages (contact_form) have no site CSS
+        sizes[job.kind] = (len(CSS), len(pruned_css(CSS, page_tokens(page))))
+  return sizes
+
+
+# -----------------------
+# MINIFY (--minify)
+# -----------------------
+# Elements whose edges make adjacent whitespace invisible (block boxes and
+# head-only elements), so whitespace touching their tags can be dropped.
+# Between inline elements a single collapsed space is kept.
+MINIFY_BLOCK_TAGS = frozenset({
+  "!doctype", "html", "head", "body", "meta", "link", "title", "style", "base",
+  "address", "article", "aside", "blockquote", "dd", "details", "div", "dl", "dt",
+  "fieldset", "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4",
+  "h5", "h6", "header", "hr", "li", "main", "nav", "ol", "p", "pre", "section",
+  "summary", "table", "tbody", "td", "tfoot", "th", "thead", "tr", "ul",
+})
+# Attribute values that are the HTML default and can be dropped.
+MINIFY_DEFAULT_ATTRS = {
+  ("script", "type"): "text/javascript",
+  ("style", "type"): "text/css",
+  ("link", "type"): "text/css",
+}
+
+_TAG_BODY = r"""[^'">]*(?:(?:"[^"]*"|'[^']*')[^'">]*)*"""  # quoted values may contain ">"
+# Everything starts with "<", so the regex engine skips text at C speed: a
+# comment, a raw-text element with its body, or any other tag.
+_MINIFY_RE = re.compile(
+  r"<(?:!--.*?-->"
+  rf"|(?P<raw>script|style|pre|textarea)(?![^\s/>])(?P<raw_attrs>{_TAG_BODY})>"
+  r"(?P<raw_body>[^<]*(?:<(?!/(?P=raw)[\s>])[^<]*)*)</(?P=raw)\s*>"
+  rf"|/?(?P<name>!?[a-zA-Z][^\s/>]*){_TAG_BODY}>)",
+  re.S | re.I,
+)
+# HTML whitespace (not \s: &nbsp; and friends are visible).
+_HTML_SPACE = " \t\n\r\f"
+_HTML_SPACE_RE = re.compile(r"[ \t\n\r\f]+")
+_TAG_PARTS_RE = re.compile(r"<(/?)([^\s/>]+)(.*)>", re.S)
+_MINIFY_ATTR_RE = re.compile(r"""([^\s"'=<>/]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?""")
+_UNQUOTED_VALUE_RE = re.compile(r"""[^\s"'=<>`]+""")
+_CSS_COMMENT_RE = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/""", re.S)
+_CSS_SPACE_RE = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|\s*;?\s*(\})\s*|\s*([{;,>])\s*|\s+""")
+_CSS_BLOCK_RE = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|([{};])|: """)
+# At-rules whose block holds rules, not declarations.
+_CSS_RULE_LIST_RE = re.compile(r"@(?:-[a-z]+-)?(?:media|supports|container|layer|keyframes|document|scope|starting-style)\b")
+
+
+@lru_cache(maxsize=64)
+def minify_css(css: str) -> str:
+  """
+  Drop comments, indentation and the spaces around punctuation (and each
+  block's last ';'). Strings are copied verbatim. The space after ':' goes
+  only in declarations and at-rule conditions (`(min-width: 600px)`): in a
+  selector (`.a :first-child`) it is a descendant combinator.
+  """
+  css = _CSS_COMMENT_RE.sub(lambda m: m.group(1) or "", css)
+  css = _CSS_SPACE_RE.sub(lambda m: next((g for g in m.groups() if g is not None), " "), css).strip()
+
+  parts: list[str] = []
+  blocks: list[bool] = []  # open blocks, innermost last: True = declarations
+  prelude = last = 0
+  for m in _CSS_BLOCK_RE.finditer(css):
+    punct = m.group(2)
+    if m.group(1):
+      continue
+    if punct == "{":
+      blocks.append(not _CSS_RULE_LIST_RE.match(css, prelude))
+      prelude = m.end()
+    elif punct:
+      if punct == "}" and blocks:
+        blocks.pop()
+      prelude = m.end()
+    elif (blocks and blocks[-1]) or css.startswith("@", prelude):  # declaration or at-rule condition
+      parts.append(css[last:m.start() + 1])
+      last = m.end()
+  parts.append(css[last:])
+  return "".join(parts)
+
+
+def minify_tag(tag: str) -> str:
+  """
+  One start/end tag with single spaces between attributes, no void-element
+  slash, default attributes dropped, and values unquoted where HTML allows it.
+  """
+  close, name, attrs = _TAG_PARTS_RE.fullmatch(tag).groups()
+  if close:
+    return f"</{name}>"
+  parts = [name]
+  name = name.lower()
+  for m in _MINIFY_ATTR_RE.finditer(attrs):
+    attr, double, single, bare = m.groups()
+    value = next((v for v in (double, single, bare) if v is not None), None)
+    if value is not None and MINIFY_DEFAULT_ATTRS.get((name, attr.lower())) == value.lower():
+      continue
+    if not value:  # `alt=""` and `alt` are the same attribute
+      parts.append(attr)
+    elif _UNQUOTED_VALUE_RE.fullmatch(value):
+      parts.append(f"{attr}={value}")
+    elif single is not None:
+      parts.append(f"{attr}='{value}'")
+    else:
+      parts.append(f'{attr}="{value}"')
+  return "<" + " ".join(parts) + ">"
+
+
+@lru_cache(maxsize=4096)
+def minify_element(token: str) -> tuple[str, bool | None]:
+  """
+  (minified text, is a block edge) for one _MINIFY_RE match; None for
+  comments, which vanish without affecting the whitespace around them.
+  Cached: nearly every tag (and each page type's <style>) repeats across pages.
+  """
+  m = _MINIFY_RE.fullmatch(token)
+  raw, name = m["raw"], m["name"]
+  if raw is None and name is None:
+    return "", None
+  if raw is None:
+    return minify_tag(token), name.lower() in MINIFY_BLOCK_TAGS
+  body = m["raw_body"]
+  if raw.lower() == "style":
+    body = minify_css(body)
+  return minify_tag(f"<{raw}{m['raw_attrs']}>") + body + f"</{raw}>", raw.lower() in MINIFY_BLOCK_TAGS
+
+
+def minify_html(page: str) -> str:
+  """
+  Minify a page in one left-to-right pass (linear in its size):
+  - whitespace runs collapse to one space, and disappear next to block tags
+    (where the browser would not render them anyway);
+  - comments go, tags are shortened by minify_tag(), <style> by minify_css();
+  - <script>, <pre> and <textarea> bodies are copied verbatim.
+  The only state is whether the last text may still lose its trailing space.
+  """
+  out: list[str] = []
+  trim = True  # the next text starts after a block edge or a space
+  text_last = False  # out[-1] is text that may still lose its trailing space
+  pos = 0
+  for m in _MINIFY_RE.finditer(page):
+    start, end = m.span()
+    if start > pos:
+      text = page[pos:start]
+      # Mostly indentation between tags, or text already single-spaced
+      # (\t\n\r\f are not printable); only the rest needs the regex.
+      if not text.strip(_HTML_SPACE):
+        text = " "
+      elif "  " in text or not text.isprintable():
+        text = _HTML_SPACE_RE.sub(" ", text)
+      if trim:
+        text = text.lstrip(" ")
+      if text:
+        out.append(text)
+        trim = text.endswith(" ")
+        text_last = True
+    pos = end
+
+    element, block = minify_element(m.group())
+    if block is None:
+      continue
+    if block:
+      if text_last and out[-1].endswith(" "):
+        out[-1] = out[-1][:-1]
+      trim = True
+    else:
+      trim = False
+    text_last = False
+    out.append(element)
+
+  text = _HTML_SPACE_RE.sub(" ", page[pos:])
+  out.append(text.strip(" ") if trim else text.rstrip(" "))
+  return "".join(out)
+
+
+def minify_savings(jobs) -> dict[str, tuple[int, int]]:
+  """
+  {page kind: (before, after) page bytes}, measured on each kind's first page.
+  """
+  sizes = {}
+  for job in jobs:
+    if job.kind not in sizes:
+      page = job.html()
+      sizes[job.kind] = (len(page.encode("utf-8")), len(minify_html(page).encode("utf-8")))
+  return sizes
+
+
+def site_css() -> str:
+  """
+  The stylesheet as written to /assets/ with --external-css.
+  """
+  return minify_css(CSS) if CONFIG.minify else CSS
+
+
+# -----------------------
+# IMAGES
+# -----------------------
+IMAGE_MIME = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+IMAGE_EXT = {"avif": "avif", "webp": "webp", "jpeg": "jpg"}
+IMAGE_SAVE_OPTIONS: dict[str, dict[str, object]] = {
+  "avif": {"quality": 55},
+  "webp": {"quality": 78, "method": 6},
+  "jpeg": {"quality": 80, "optimize": True, "progressive": True},
+}
+
+
+@dataclass(frozen=True)
+class ImageVariant:
+  fmt: str
+  width: int
+  height: int
+  path: str  # relative to output_dir, content-hashed
+
+
+@dataclass(frozen=True)
+class ImageSet:
+  width: int  # intrinsic size of the source image
+  height: int
+  variants: tuple[ImageVariant, ...]
+
+  def srcset(self, fmt: str) -> str:
+    return ", ".join(f"{root_url(v.path)} {v.width}w" for v in self.variants if v.fmt == fmt)
+
+  def formats(self) -> list[str]:
+    return list(dict.fromkeys(v.fmt for v in self.variants))
+
+
+def source_image_path() -> Path:
+  return Path(__file__).resolve().parent / CONFIG.image_filename
+
+
+def encodable_image_formats(formats: tuple[str, ...]) -> tuple[str, ...]:
+  if Image is None:
+    return ()
+  Image.init()
+  return tuple(fmt for fmt in formats if fmt.upper() in Image.SAVE)
+
+
+@cache
+def responsive_image_set(config: SiteConfig, src: Path, src_hash: str) -> ImageSet | None:
+  """
+  Plan the derivatives of `src` (no encoding happens here). None when the
+  feature is off or Pillow is unavailable, so pages keep the original <img>.
+  """
+  formats = encodable_image_formats(config.image_formats)
+  if not config.responsive_images or "jpeg" not in formats:
+    return None
+
+  with Image.open(src) as im:
+    width, height = im.size
+
+  widths = sorted({min(w, width) for w in config.image_widths})
+  stem = Path(config.image_filename).stem
+  variants = []
+  for fmt in formats:
+    for w in widths:
+      h = round(height * w / width)
+      tag = digest(src_hash, fmt, w, IMAGE_SAVE_OPTIONS[fmt])[:12]
+      variants.append(ImageVariant(fmt, w, h, f"assets/{stem}-{w}.{tag}.{IMAGE_EXT[fmt]}"))
+
+  return ImageSet(width=width, height=height, variants=tuple(variants))
+
+
+def current_image_set() -> ImageSet | None:
+  if not CONFIG.responsive_images:
+    return None
+  src = source_image_path()
+  return responsive_image_set(CONFIG, src, file_digest(src))
+
+
+def ensure_image_variants(src: Path, images: ImageSet, cache_dir: Path) -> dict[str, Path]:
+  """
+  Encode any derivative missing from the cache. Filenames embed the source
+  hash, so a cached file is always current and only new sources get encoded.
+  Returns {output path: cached file}.
+  """
+  cache_dir.mkdir(parents=True, exist_ok=True)
+  cached = {v.path: cache_dir / Path(v.path).name for v in images.variants}
+  missing = [v for v in images.variants if not cached[v.path].exists()]
+
+  if missing:
+    with Image.open(src) as im:
+      im.load()
+      for v in missing:
+        resized = im.resize((v.width, v.height), Image.LANCZOS)
+        if v.fmt == "jpeg" and resized.mode != "RGB":
+          resized = resized.convert("RGB")
+        tmp = cached[v.path].with_name(cached[v.path].name + ".tmp")
+        resized.save(tmp, format=v.fmt.upper(), **IMAGE_SAVE_OPTIONS[v.fmt])
+        os.replace(tmp, cached[v.path])
+
+  return cached
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def image_size(path: Path) -> tuple[int, int] | None:
+  """
+  Intrinsic (width, height) of an image: read from the PNG IHDR chunk (no
+  Pillow needed), else via Pillow if installed; None when unknown.
+  """
+  with path.open("rb") as f:
+    head = f.read(24)
+  if head[:8] == PNG_SIGNATURE and head[12:16] == b"IHDR":
+    return struct.unpack(">II", head[16:24])
+  if Image is None:
+    return None
+  try:
+    with Image.open(path) as im:
+      return im.size
+  except OSError:
+    return None
+
+
+def loading_attrs(above_fold: bool) -> str:
+  """
+  The LCP candidate loads eagerly at high priority; everything else lazily.
+  """
+  return 'loading="eager" fetchpriority="high"' if above_fold else 'loading="lazy"'
+
+
+def image_preload_html() -> str:
+  """
+  <link rel="preload"> for the above-the-fold image, matching what the <img>
+  (or, with derivatives, the first <picture> source) will request.
+  """
+  images = current_image_set()
+  if images is None:
+    return f'<link rel="preload" as="image" href="/{esc(CONFIG.image_filename)}" fetchpriority="high" />'
+  fmt = images.formats()[0]
+  return (
+    f'<link rel="preload" as="image" type="{IMAGE_MIME[fmt]}" imagesrcset="{esc(images.srcset(fmt))}" '
+    f'imagesizes="{esc(CONFIG.image_sizes)}" fetchpriority="high" />'
+  )
+
+
+def image_html(*, above_fold: bool = False) -> str:
+  images = current_image_set()
+  if images is None:
+    img_src = f"/{CONFIG.image_filename}"
+    size = image_size(source_image_path())
+    dims = f' width="{size[0]}" height="{size[1]}"' if size else ""
+    return f"""
+    <div class="img">
+      <img src="{esc(img_src)}"{dims} alt="Service image" {loading_attrs(above_fold)} />
+    </div>
+""".rstrip()
+
+  sources = "".join(
+    f'\n        <source type="{IMAGE_MIME[fmt]}" srcset="{esc(images.srcset(fmt))}" sizes="{esc(CONFIG.image_sizes)}" />'
+    for fmt in images.formats()
+    if fmt != "jpeg"
+  )
+  fallback = [v for v in images.variants if v.fmt == "jpeg"][-1]
+
+  return f"""
+    <div class="img">
+      <picture>{sources}
+        <img src="{esc(root_url(fallback.path))}" srcset="{esc(images.srcset("jpeg"))}" sizes="{esc(CONFIG.image_sizes)}" width="{images.width}" height="{images.height}" alt="Service image" {loading_attrs(above_fold)} />
+      </picture>
+    </div>
+""".rstrip()
+
+
 # -----------------------
 # HTML BUILDING BLOCKS
 # -----------------------
@@ -656,17 +1458,16 @@ def nav_html(current: str) -> str:
   )
 
 
-def base_html(*, title: str, canonical_url: str, current_nav: str, body: str) -> str:
+def base_html(*, title: str, canonical_url: str, current_nav: str, body: str, head_extra: str = "") -> str:
+  head_extra = f"\n  {head_extra}" if head_extra else ""
   return f"""<!doctype html>
 <html lang="en">
 <head>
   <meta charset="utf-8" />
   <meta name="viewport" content="width=device-width, initial-scale=1" />
   <title>{esc(title)}</title>
-  <link rel="canonical" href="{esc(canonical_url)}" />
-  <style>
-{CSS}
-  </style>
+  <link rel="canonical" href="{esc(canonical_url)}" />{head_extra}
+  {stylesheet_html()}
 </head>
 <body>
   <div class="topbar">
@@ -719,14 +1520,9 @@ def footer_block(*, show_cta: bool = True) -> str:
 
 
 def page_shell(*, h1: str, sub: str, inner_html: str, show_image: bool = True, show_footer_cta: bool = True) -> str:
-  img_src = f"/{CONFIG.image_filename}"
-  img_html = ""
-  if show_image:
-    img_html = f"""
-    <div class="img">
-      <img src="{esc(img_src)}" alt="Service image" loading="lazy" />
-    </div>
-""".rstrip()
+  # The image opens the main card, right under the hero: in the first
+  # viewport on every page that shows it, so it is the LCP element.
+  img_html = image_html(above_fold=True) if show_image else ""
 
   return (
     header_block(h1=h1, sub=sub)
@@ -742,9 +1538,56 @@ def page_shell(*, h1: str, sub: str, inner_html: str, show_image: bool = True, s
   ).rstrip()
 
 
+# -----------------------
+# FRAGMENT CACHE
+# -----------------------
+# Shared sections (main_h2/main_p, cost_h2/cost_p, ...) are identical on every
+# city page, so their HTML is memoised instead of re-running the regex + escape.
+FRAGMENT_CACHE_SIZE = 1024
+FRAGMENT_CACHES: dict[str, object] = {}
+
+
+def _freeze(value: object) -> object:
+  if isinstance(value, (list, tuple)):
+    return tuple(_freeze(v) for v in value)
+  return value
+
+
+def fragment_cache(fn):
+  """
+  LRU-cache an HTML fragment builder. Arguments are normalised (lists become
+  tuples) and the current CONFIG is part of the key, since fragments read it.
+  """
+  @lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+  def cached(config: SiteConfig, args: tuple, kwargs: tuple) -> str:
+    return fn(*args, **dict(kwargs))
+
+  @wraps(fn)
+  def wrapper(*args, **kwargs):
+    frozen_kwargs = tuple(sorted((k, _freeze(v)) for k, v in kwargs.items()))
+    return cached(CONFIG, _freeze(args), frozen_kwargs)
+
+  wrapper.cache_info = cached.cache_info
+  wrapper.cache_clear = cached.cache_clear
+  FRAGMENT_CACHES[fn.__name__] = wrapper
+  return wrapper
+
+
+def fragment_cache_stats() -> dict[str, list[int]]:
+  """
+  {fragment name: [hits, misses]} for this process.
+  """
+  stats = {}
+  for name, fn in FRAGMENT_CACHES.items():
+    info = fn.cache_info()
+    stats[name] = [info.hits, info.misses]
+  return stats
+
+
 # -----------------------
 # CONTENT SECTIONS
 # -----------------------
+@fragment_cache
 def linkify_curly(text: str) -> str:
   """
   Replace {word} with a link to the ROOT homepage (apex), not the current subdomain.
@@ -764,6 +1607,7 @@ def linkify_curly(text: str) -> str:
   return "".join(parts)
 
 
+@fragment_cache
 def make_section(*, headings: list[str], paras: list[str]) -> str:
   parts: list[str] = []
   for h2, p in zip(headings, paras):
@@ -772,53 +1616,119 @@ def make_section(*, headings: list[str], paras: list[str]) -> str:
   return "\n".join(parts)
 
 
-def location_cost_section(city: str, state: str, col: float) -> str:
-  cost_lo = f"<strong>${int(CONFIG.cost_low * col)}</strong>"
-  cost_hi = f"<strong>${int(CONFIG.cost_high * col)}</strong>"
+_COST_MARKS = {"{City, State}": "\x00city\x00", "{cost_lo}": "\x00lo\x00", "{cost_hi}": "\x00hi\x00"}
 
-  h2 = CONFIG.location_cost_h2.replace("{City, State}", f"{city}, {state}")
 
-  p = (
-    CONFIG.location_cost_p
-    .replace("{City, State}", f"{city}, {state}")
-    .replace("{cost_lo}", cost_lo)
-    .replace("{cost_hi}", cost_hi)
-  )
+@fragment_cache
+def location_cost_template() -> str:
+  """
+  The location cost section rendered once per config, with marker strings
+  where the city label and price range go (esc() and linkify_curly() leave
+  the NUL-delimited markers alone).
+  """
+  h2, p = CONFIG.location_cost_h2, CONFIG.location_cost_p
+  for placeholder, mark in _COST_MARKS.items():
+    h2 = h2.replace(placeholder, mark)
+    p = p.replace(placeholder, mark)
 
   # p is HTML-ish; we do NOT esc() the whole string. linkify_curly escapes non-tag text safely.
   return f"<h2>{esc(h2)}</h2>\n<p>{linkify_curly(p)}</p>"
 
 
+def location_cost_section(city: City) -> str:
+  return (
+    location_cost_template()
+    .replace(_COST_MARKS["{City, State}"], city.label_html)
+    .replace(_COST_MARKS["{cost_lo}"], esc(f"<strong>{city.cost_lo}</strong>"))
+    .replace(_COST_MARKS["{cost_hi}"], esc(f"<strong>{city.cost_hi}</strong>"))
+  )
+
+
 # -----------------------
-# PAGE FACTORY
+# COMPILED LAYOUTS
 # -----------------------
-def make_page(*, h1: str, canonical_url: str, nav_key: str, sub: str, inner: str, show_image: bool = True, show_footer_cta: bool = True) -> str:
-  h1 = clamp_title(h1, 70)
-  title = h1  # enforce title == h1
-  return base_html(
-    title=title,
-    canonical_url=canonical_url,
+# base_html/page_shell stay the single source of truth for the markup. They are
+# rendered once per layout with marker strings in the per-page slots, then split
+# into constant chunks so make_page() only splices the per-page values.
+LAYOUT_SLOTS = ("title", "canonical_url", "h1", "sub", "inner")
+_SLOT_MARK = "\x00{}\x00"
+_SLOT_RE = re.compile("\x00(" + "|".join(LAYOUT_SLOTS) + ")\x00")
+
+
+@dataclass(frozen=True)
+class CompiledLayout:
+  chunks: tuple[str, ...]  # constant text around the slots (len(slots) + 1)
+  slots: tuple[str, ...]  # slot filled between chunks[i] and chunks[i + 1]
+
+  def render(self, values: dict[str, str]) -> str:
+    parts = [self.chunks[0]]
+    for name, chunk in zip(self.slots, self.chunks[1:]):
+      parts.append(values[name])
+      parts.append(chunk)
+    return "".join(parts)
+
+
+@cache
+def compiled_layout(
+  config: SiteConfig, nav_key: str, show_image: bool, show_footer_cta: bool, head_extra: str = ""
+) -> CompiledLayout:
+  """
+  Pre-rendered page skeleton. `config` is part of the cache key so a swapped
+  CONFIG never reuses a stale skeleton.
+  """
+  mark = {name: _SLOT_MARK.format(name) for name in LAYOUT_SLOTS}
+  page = base_html(
+    title=mark["title"],
+    canonical_url=mark["canonical_url"],
     current_nav=nav_key,
-    body=page_shell(h1=h1, sub=sub, inner_html=inner, show_image=show_image, show_footer_cta=show_footer_cta),
+    head_extra="\n  ".join(filter(None, (image_preload_html() if show_image else "", head_extra))),
+    body=page_shell(
+      h1=mark["h1"],
+      sub=mark["sub"],
+      inner_html=mark["inner"],
+      show_image=show_image,
+      show_footer_cta=show_footer_cta,
+    ),
   )
+  pieces = _SLOT_RE.split(page)
+  return CompiledLayout(chunks=tuple(pieces[0::2]), slots=tuple(pieces[1::2]))
+
+
+# -----------------------
+# PAGE FACTORY
+# -----------------------
+def make_page(
+  *, h1: str, canonical_url: str, nav_key: str, sub: str, inner: str,
+  show_image: bool = True, show_footer_cta: bool = True, head_extra: str = "",
+) -> str:
+  h1 = esc(clamp_title(h1, 70))
+  layout = compiled_layout(CONFIG, nav_key, show_image, show_footer_cta, head_extra)
+  return layout.render({
+    "title": h1,  # enforce title == h1
+    "canonical_url": esc(canonical_url),
+    "h1": h1,
+    "sub": esc(sub),
+    "inner": inner,
+  })
 
 
 def homepage_html() -> str:
-  # ✅ IMPORTANT: city links must be absolute subdomain URLs
-  city_links = "\n".join(
-    f'<li><a href="{esc(city_url(city, state))}">{esc(city)}, {esc(state)}</a></li>'
-    for city, state, _ in CITIES
+  # One link per state hub keeps the homepage a fixed size however many cities there are.
+  state_links = "\n".join(
+    f'<li><a href="{esc(state_url(state))}">{esc(state_name(state))}</a></li>'
+    for state, _ in cities_by_state(get_cities())
   )
 
   inner = (
     make_section(headings=CONFIG.main_h2, paras=CONFIG.main_p)
     + """
 <hr />
-<h2>Choose your city</h2>
-<p class="muted">We provide services nationwide, including in the following cities:</p>
+<h2>Choose your state</h2>
+<p class="muted">We provide services nationwide, including in the following states:</p>
 <ul class="city-grid">
 """
-    + city_links
+    + state_links
+    + "\n</ul>"
   )
 
   return make_page(
@@ -830,6 +1740,108 @@ def homepage_html() -> str:
   )
 
 
+def pager_html(state: str, page: int, pages: int) -> str:
+  """
+  Previous/next plus a window of page numbers (bounded size for any page count).
+  """
+  if pages <= 1:
+    return ""
+  shown = sorted({1, pages, *range(max(1, page - 2), min(pages, page + 2) + 1)})
+  parts = []
+  if page > 1:
+    parts.append(f'<a href="{esc(state_url(state, page - 1))}" rel="prev">← Previous</a>')
+  last = 0
+  for n in shown:
+    if n > last + 1:
+      parts.append("…")
+    parts.append(f"<strong>{n}</strong>" if n == page else f'<a href="{esc(state_url(state, n))}">{n}</a>')
+    last = n
+  if page < pages:
+    parts.append(f'<a href="{esc(state_url(state, page + 1))}" rel="next">Next →</a>')
+  return f'\n<p class="muted">Page {page} of {pages}: ' + " · ".join(parts) + "</p>"
+
+
+def state_page_html(state: str, page: int, pages: int, cities: tuple[City, ...]) -> str:
+  # ✅ IMPORTANT: city links must be absolute subdomain URLs
+  city_links = "\n".join(
+    f'<li><a href="{esc(c.url)}">{c.label_html}</a></li>'
+    for c in cities
+  )
+  name = esc(state_name(state))
+
+  inner = (
+    f"""
+<h2>Choose your city in {name}</h2>
+<p class="muted">We provide services in the following {name} cities:</p>
+<ul class="city-grid">
+"""
+    + city_links
+    + "\n</ul>"
+    + pager_html(state, page, pages)
+  )
+
+  return make_page(
+    h1=state_title(state),
+    canonical_url=state_url(state, page),
+    nav_key="home",
+    sub=CONFIG.h1_sub,
+    inner=inner,
+  )
+
+
+NETWORX_ORIGIN = "https://api.networx.com"
+NETWORX_EMBED_SRC = f"{NETWORX_ORIGIN}/iframe.php?aff_id=73601bc3bd5a961a61a973e92e29f169&aff_to_form_id=8002"
+CONTACT_FORM_PATH = "/contact/form/"
+
+# Facade mode: warm the Networx connection early, and give the placeholder
+# the box the embed occupies (its inline 242px width, the CSS 520px
+# min-height) so swapping in the iframe shifts nothing.
+NETWORX_FACADE_HEAD = f"""<link rel="preconnect" href="{NETWORX_ORIGIN}" />
+  <style>
+#nx_form.nx-facade{{width:242px;height:520px;display:flex;flex-direction:column;align-items:center;justify-content:center;gap:10px;text-align:center}}
+.nx-facade iframe{{display:block}}
+  </style>"""
+
+
+def networx_embed_html() -> str:
+  return f"""
+<div id="networx_form_container" style="margin:0px;padding:0px;">
+    <div id = "nx_form" style = "width: 242px; height: 375px;">
+        <script type="text/javascript" src = "{NETWORX_EMBED_SRC}"></script>
+    </div>
+</div>
+""".strip()
+
+
+def networx_facade_html() -> str:
+  """
+  Static stand-in for the embed at the form's size. A link to the standalone
+  form works without JS; with JS the form loads in place on the first click.
+  Nothing loads on view: the placeholder sits above the fold, so a
+  visibility trigger would fetch the embed on every page load.
+  """
+  return f"""
+<div id="networx_form_container">
+  <div id="nx_form" class="nx-facade">
+    <p class="sub">Tell us about the damage and get a free estimate.</p>
+    <a class="btn" href="{CONTACT_FORM_PATH}">Open the estimate form</a>
+  </div>
+</div>
+<script>
+(function () {{
+  var box = document.getElementById("nx_form");
+  box.addEventListener("click", function (e) {{
+    e.preventDefault();
+    var frame = document.createElement("iframe");
+    frame.src = "{CONTACT_FORM_PATH}";
+    frame.title = "Free estimate form";
+    box.replaceChildren(frame);
+  }}, {{ once: true }});
+}})();
+</script>
+""".strip()
+
+
 def contact_page_html() -> str:
   h1 = "Get Your Free Estimate"
   sub = "All you have to do is fill out the form below."
@@ -847,13 +1859,7 @@ def contact_page_html() -> str:
     for t in why_bullets
   )
 
-  networx_embed = """
-<div id="networx_form_container" style="margin:0px;padding:0px;">
-    <div id = "nx_form" style = "width: 242px; height: 375px;">
-        <script type="text/javascript" src = "https://api.networx.com/iframe.php?aff_id=73601bc3bd5a961a61a973e92e29f169&aff_to_form_id=8002"></script>
-    </div>
-</div>
-""".strip()
+  networx_embed = networx_facade_html() if CONFIG.networx_facade else networx_embed_html()
 
   inner = f"""
 <div class="form-grid">
@@ -880,19 +1886,54 @@ def contact_page_html() -> str:
     inner=inner,
     show_image=False,
     show_footer_cta=False,
+    head_extra=NETWORX_FACADE_HEAD if CONFIG.networx_facade else "",
   )
 
 
-def city_page_html(city: str, state: str, col: float) -> str:
-  inner = (
-    location_cost_section(city, state, col)
-    + make_section(headings=list(CONFIG.main_h2), paras=list(CONFIG.main_p))
-  )
-
-  # ✅ Canonical should be the subdomain root
-  return make_page(
-    h1=city_title(city, state),
-    canonical_url=city_url(city, state),
+def contact_form_page_html() -> str:
+  """
+  Standalone Networx form (--networx-facade): what the contact-page facade
+  loads in its iframe, and where its link goes without JS. Not indexed.
+  """
+  return f"""<!doctype html>
+<html lang="en">
+<head>
+  <meta charset="utf-8" />
+  <meta name="viewport" content="width=device-width, initial-scale=1" />
+  <meta name="robots" content="noindex" />
+  <title>Free Estimate Form</title>
+  <link rel="preconnect" href="{NETWORX_ORIGIN}" />
+  <style>
+body{{margin:0}}
+#nx_form{{min-height:100vh;margin:0 auto}}
+#networx_form_container iframe{{width:100%;height:100%;border:0}}
+  </style>
+</head>
+<body>
+{networx_embed_html()}
+</body>
+</html>
+"""
+
+
+def nearby_section(nearby: tuple[City, ...]) -> str:
+  if not nearby:
+    return ""
+  links = "\n".join(f'<li><a href="{esc(c.url)}">{c.label_html}</a></li>' for c in nearby)
+  return f'\n<hr />\n<h2>{esc(CONFIG.nearby_h2)}</h2>\n<ul class="city-grid">\n{links}\n</ul>'
+
+
+def city_page_html(city: City, nearby: tuple[City, ...] = ()) -> str:
+  inner = (
+    location_cost_section(city)
+    + make_section(headings=list(CONFIG.main_h2), paras=list(CONFIG.main_p))
+    + nearby_section(nearby)
+  )
+
+  # ✅ Canonical should be the subdomain root
+  return make_page(
+    h1=city_title(city.name, city.state),
+    canonical_url=city.url,
     nav_key="home",
     sub=CONFIG.h1_sub,
     inner=inner,
@@ -908,9 +1949,9 @@ def cost_page_html() -> str:
     inner=make_section(headings=list(CONFIG.cost_h2), paras=list(CONFIG.cost_p)),
   )
 
-def city_cost_page_html(city: str, state: str, col: float) -> str:
-  cost_lo = f"<strong>${int(CONFIG.cost_low * col)}</strong>"
-  cost_hi = f"<strong>${int(CONFIG.cost_high * col)}</strong>"
+def city_cost_page_html(city: City) -> str:
+  cost_lo = f"<strong>{city.cost_lo}</strong>"
+  cost_hi = f"<strong>{city.cost_hi}</strong>"
 
   localized_paras = [
     p.replace("{cost_lo}", cost_lo).replace("{cost_hi}", cost_hi)
@@ -923,8 +1964,8 @@ def city_cost_page_html(city: str, state: str, col: float) -> str:
   )
 
   return make_page(
-    h1=city_cost_title(city, state),
-    canonical_url=city_url(city, state) + "cost/",
+    h1=city_cost_title(city.name, city.state),
+    canonical_url=city.url + "cost/",
     nav_key="cost",
     sub=CONFIG.cost_sub,
     inner=inner,
@@ -944,22 +1985,47 @@ def howto_page_html() -> str:
 # -----------------------
 # ROBOTS + SITEMAP + WRANGLER
 # -----------------------
+SITEMAP_MAX_URLS = 50_000  # protocol limit per sitemap file
+SITEMAP_INDEX = "sitemap.xml"  # the index keeps the long-standing URL; shards are sitemap-N.xml
+SITEMAP_HEAD = (
+  '<?xml version="1.0" encoding="UTF-8"?>\n'
+  '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+)
+SITEMAP_TAIL = "</urlset>\n"
+
+
 def robots_txt() -> str:
-  return "User-agent: *\nAllow: /\nSitemap: /sitemap.xml\n"
+  return f"User-agent: *\nAllow: /\nSitemap: {root_url(SITEMAP_INDEX)}\n"
+
+
+def sitemap_url_xml(url: str, lastmod: str | None = None) -> str:
+  if lastmod is None:
+    return f"  <url><loc>{esc(url)}</loc></url>\n"
+  return f"  <url><loc>{esc(url)}</loc><lastmod>{lastmod}</lastmod></url>\n"
 
 
 def sitemap_xml(urls: list[str]) -> str:
+  """
+  One-shot sitemap (no lastmod); the build streams shards via SitemapWriter.
+  """
+  return SITEMAP_HEAD + "".join(sitemap_url_xml(u) for u in urls) + SITEMAP_TAIL
+
+
+def sitemap_index_xml(shards: list[tuple[str, str]]) -> str:
   return (
     '<?xml version="1.0" encoding="UTF-8"?>\n'
-    '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
-    + "".join(f"  <url><loc>{esc(u)}</loc></url>\n" for u in urls)
-    + "</urlset>\n"
+    '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    + "".join(
+      f"  <sitemap><loc>{esc(root_url(path))}</loc><lastmod>{lastmod}</lastmod></sitemap>\n"
+      for path, lastmod in shards
+    )
+    + "</sitemapindex>\n"
   )
 
 
 def wrangler_content() -> str:
   name = CONFIG.base_name.lower().replace(" ", "-")
-  today = date.today().isoformat()
+  today = CONFIG.build_day()
 
   return f"""{{
   "name": "{name}",
@@ -972,49 +2038,1881 @@ def wrangler_content() -> str:
 
 
 # -----------------------
-# MAIN
+# HOST CONFIG (vercel.json, _headers, Cloudflare redirect rules)
 # -----------------------
-def main() -> None:
-  script_dir = Path(__file__).resolve().parent
-  out = CONFIG.output_dir
+# Generated from the same pages and city list as the site and the same
+# policy as cache_control(). vercel.json and the Cloudflare rules live outside
+# the output and are read before any build runs (Vercel reads the committed
+# vercel.json; the rules are applied through the Cloudflare API), so the
+# build reports when either changed:
+# - /assets/* (content-hashed) is immutable; everything else gets
+#   CONFIG.page_cache_control (short TTL + stale-while-revalidate).
+# - www.<apex> redirects to the apex; /<slug>/ on the apex redirects to the
+#   city subdomain; <slug>.<SUBDOMAIN_BASE> serves /<slug>/ except shared paths.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def shared_paths() -> tuple[str, ...]:
+  """
+  Root paths every host serves from the site root, never from a city's
+  /<slug>/ tree: hashed assets and the image pages reference root-relative.
+  A trailing "/" covers the whole directory.
+  """
+  return ("/assets/", "/" + CONFIG.image_filename)
+
+
+def is_shared_path(path: str) -> bool:
+  return any(path.startswith(p) if p.endswith("/") else path == p for p in shared_paths())
 
-  reset_output_dir(out)
 
-  # Shared image into /public/
-  copy_site_image(src_dir=script_dir, out_dir=out, filename=CONFIG.image_filename)
+def apex_host() -> str:
+  return CONFIG.site_origin.split("://", 1)[-1].split("/", 1)[0].lower()
 
-  # Core pages (root domain)
-  write_text(out / "index.html", homepage_html())
-  write_text(out / "cost" / "index.html", cost_page_html())
-  write_text(out / "how-to" / "index.html", howto_page_html())
-  write_text(out / "contact" / "index.html", contact_page_html())
+
+def city_slug_re(cities: tuple[City, ...]) -> str:
+  """
+  Regex matching every city slug: city_state_slug() always ends in -<state>,
+  and only states present in the city list are allowed.
+  """
+  states = sorted({slugify(city.state) for city in cities})
+  return rf"[a-z0-9-]+-(?:{'|'.join(states)})"
+
+
+def check_city_slug_re(pattern: str, jobs: list[PageJob]) -> None:
+  """
+  The apex redirect must never catch a root-site directory (/how-to/, /states/...).
+  """
+  roots = {job.path.split("/", 1)[0] for job in jobs if job.kind not in ("city", "city_cost")}
+  roots |= {p.strip("/").split("/", 1)[0] for p in shared_paths()}
+  clashes = sorted(root for root in roots if re.fullmatch(pattern, root))
+  if clashes:
+    raise ValueError(f"City slug pattern {pattern!r} would also redirect: {', '.join(clashes)}")
+
+
+def vercel_config(cities: tuple[City, ...], jobs: list[PageJob]) -> dict:
+  """
+  vercel.json (legacy `routes`): cache headers first (continue), then the
+  www and apex-city redirects, then the subdomain rewrite.
+  """
+  slug_re = city_slug_re(cities)
+  check_city_slug_re(slug_re, jobs)
+  apex = re.escape(apex_host())
+  shared = "|".join(re.escape(p[1:]) + ("" if p.endswith("/") else "$") for p in shared_paths())
+  return {
+    "routes": [
+      {"src": "/assets/(.*)", "headers": {"Cache-Control": IMMUTABLE_CACHE_CONTROL}, "continue": True},
+      {"src": "/(?!assets/)(.*)", "headers": {"Cache-Control": CONFIG.page_cache_control}, "continue": True},
+      {
+        "src": "/(.*)",
+        "has": [{"type": "host", "value": f"^www\\.{apex}$"}],
+        "status": 308,
+        "headers": {"Location": root_url("$1")},
+      },
+      {
+        "src": f"/(?<slug>{slug_re})(?:/(.*))?",
+        "has": [{"type": "host", "value": f"^{apex}$"}],
+        "status": 308,
+        "headers": {"Location": subdomain_url("$slug") + "$2"},
+      },
+      {
+        "src": f"/(?!{shared})(.*)",
+        "has": [{"type": "host", "value": f"^(?<city>{slug_re})\\.{re.escape(CONFIG.subdomain_base)}$"}],
+        "dest": "/$city/$1",
+      },
+    ]
+  }
+
+
+def vercel_json(cities: tuple[City, ...], jobs: list[PageJob]) -> str:
+  return json.dumps(vercel_config(cities, jobs), indent=2) + "\n"
+
+
+def headers_file() -> str:
+  """
+  Cloudflare static-assets `_headers`. Values of every rule matching a
+  request are merged, so each host rule (apex, then city subdomains) sets
+  the page policy and detaches it again (`! Cache-Control`) on the shared
+  paths, whose own rules come last and apply on every host.
+  """
+  lines: list[str] = []
+  for host in (apex_host(), f":city.{CONFIG.subdomain_base}"):
+    lines += [f"https://{host}/*", f"  Cache-Control: {CONFIG.page_cache_control}"]
+    for path in shared_paths():
+      lines += [f"https://{host}{path}{'*' if path.endswith('/') else ''}", "  ! Cache-Control"]
+  for path in shared_paths():
+    lines += [f"{path}{'*' if path.endswith('/') else ''}", f"  Cache-Control: {cache_control(path)}"]
+  return "\n".join(lines) + "\n"
+
+
+def cloudflare_redirect_rules(cities: tuple[City, ...], jobs: list[PageJob]) -> dict:
+  """
+  Cloudflare Single Redirect rules (body for PUT /zones/<zone>/rulesets/phases/
+  http_request_dynamic_redirect/entrypoint). _redirects matches paths only and
+  would loop once a subdomain request is rewritten to /<slug>/, so both
+  redirects are conditioned on the host, as in vercel.json: www -> apex, and
+  apex /<slug>/... -> the city subdomain (wildcards match lazily, so ${2} is
+  the first path segment). Two rules whatever the number of cities.
+  """
+  slug_re = city_slug_re(cities)
+  check_city_slug_re(slug_re, jobs)
+  apex = apex_host()
+  states = sorted({slugify(city.state) for city in cities})
+  roots = sorted({
+    "/" + posixpath.dirname(job.path) + "/" for job in jobs if job.kind not in ("city", "city_cost")
+  })
+  state_re = rf"/.*-(?:{'|'.join(states)})/.*"
+  clashes = [root for root in roots if re.fullmatch(state_re, root, re.IGNORECASE)]
+  if clashes:
+    raise ValueError(f"Apex city redirect would also catch: {', '.join(clashes)}")
+
+  city_paths = " or ".join(f'http.request.uri.path wildcard "/*-{st}/*"' for st in states)
+  target = subdomain_url("${2}") + "${3}"
+  return {
+    "rules": [
+      {
+        "description": "www -> apex",
+        "expression": f'(http.host eq "www.{apex}")',
+        "action": "redirect",
+        "action_parameters": {
+          "from_value": {
+            "status_code": 308,
+            "target_url": {"expression": f'concat("{root_url("").rstrip("/")}", http.request.uri.path)'},
+            "preserve_query_string": True,
+          }
+        },
+      },
+      {
+        "description": "apex /<slug>/ -> city subdomain",
+        "expression": f'(http.host eq "{apex}" and ({city_paths}))',
+        "action": "redirect",
+        "action_parameters": {
+          "from_value": {
+            "status_code": 308,
+            "target_url": {
+              "expression": f'wildcard_replace(http.request.full_uri, "*://{apex}/*/*", "{target}")'
+            },
+            "preserve_query_string": False,  # ${3} already carries the query string
+          }
+        },
+      },
+    ]
+  }
+
+
+def cloudflare_rules_json(cities: tuple[City, ...], jobs: list[PageJob]) -> str:
+  return json.dumps(cloudflare_redirect_rules(cities, jobs), indent=2) + "\n"
+
+
+def host_files() -> list[tuple[str, str]]:
+  """
+  Host config files that live inside output_dir (Cloudflare only).
+  """
+  return [("_headers", headers_file())] if CONFIG.cloudflare_headers else []
+
+
+# -----------------------
+# NEARBY CITIES (k-d tree)
+# -----------------------
+def unit_vector(lat: float, lon: float) -> tuple[float, float, float]:
+  """
+  Point on the unit sphere: straight-line (chord) distance between two of
+  these orders cities exactly like great-circle distance.
+  """
+  la, lo = math.radians(lat), math.radians(lon)
+  return (math.cos(la) * math.cos(lo), math.cos(la) * math.sin(lo), math.sin(la))
+
+
+class KDTree:
+  """
+  Static 3-d tree over points, built once in O(n log n) by median splits on
+  the widest axis, with small leaf buckets (fewer Python-level steps per
+  query); k-nearest queries visit O(log n) nodes on average.
+  """
+
+  LEAF_SIZE = 12
+
+  def __init__(self, points: list[tuple[float, float, float]]) -> None:
+    self.points = points
+    self.axis: list[int] = []  # -1 = leaf
+    self.split: list[float] = []
+    self.left: list[int] = []
+    self.right: list[int] = []
+    self.bucket: list[list[int]] = []  # leaf point indices
+    self.root = self._build(list(range(len(points))))
+
+  def _build(self, idx: list[int]) -> int:
+    node = len(self.axis)
+    self.axis.append(-1)
+    self.split.append(0.0)
+    self.left.append(-1)
+    self.right.append(-1)
+    self.bucket.append(idx)
+    if len(idx) <= self.LEAF_SIZE:
+      return node
+
+    points = self.points
+    spreads = [max(points[i][a] for i in idx) - min(points[i][a] for i in idx) for a in range(3)]
+    axis = spreads.index(max(spreads))
+    idx.sort(key=lambda i: points[i][axis])
+    mid = len(idx) // 2
+    self.axis[node] = axis
+    self.split[node] = points[idx[mid]][axis]
+    self.bucket[node] = []
+    self.left[node] = self._build(idx[:mid])
+    self.right[node] = self._build(idx[mid:])
+    return node
+
+  def nearest(self, q: tuple[float, float, float], k: int, exclude: int = -1) -> list[tuple[float, int]]:
+    """
+    The k points closest to q as (squared distance, index), nearest first;
+    equal distances prefer the lower index.
+    """
+    if k <= 0 or not self.points:
+      return []
+    heap: list[tuple[float, int]] = []  # max-heap of (-d2, -index)
+    points, axes, splits, left, right, bucket = (
+      self.points, self.axis, self.split, self.left, self.right, self.bucket
+    )
+    qx, qy, qz = q
+    stack = [(self.root, 0.0)]  # (node, squared distance from q to its region, lower bound)
+    while stack:
+      node, gap = stack.pop()
+      if len(heap) == k and gap > -heap[0][0]:
+        continue
+      axis = axes[node]
+      if axis < 0:
+        for i in bucket[node]:
+          if i == exclude:
+            continue
+          x, y, z = points[i]
+          item = (-((qx - x) ** 2 + (qy - y) ** 2 + (qz - z) ** 2), -i)
+          if len(heap) < k:
+            heapq.heappush(heap, item)
+          elif item > heap[0]:  # closer, or as close with a lower index
+            heapq.heapreplace(heap, item)
+        continue
+      diff = q[axis] - splits[node]
+      near, far = (left[node], right[node]) if diff < 0 else (right[node], left[node])
+      stack.append((far, max(gap, diff * diff)))
+      stack.append((near, gap))
+    return sorted((-nd2, -ni) for nd2, ni in heap)
+
+
+def nearby_cities(
+  cities: tuple[City, ...], k: int, cache: dict[str, dict] | None = None
+) -> tuple[dict[str, tuple[City, ...]], dict[str, dict], int]:
+  """
+  slug -> the k nearest other cities (only cities with lat/lon take part).
+
+  Also returns the cache to keep in the build manifest, {slug: {"at": [lat,
+  lon], "near": [slugs], "r": squared distance to the k-th}}, and how many
+  lists were recomputed. A cached list is reused unless the city moved, one
+  of its neighbours moved or disappeared, or a new/moved city now lies
+  within its radius (found with a k-d tree of just the changed cities).
+  """
+  located = [c for c in cities if c.lat is not None]
+  k = min(k, len(located) - 1)
+  if k <= 0:
+    return {}, {}, 0
+
+  cache = cache or {}
+  by_slug = {c.slug: c for c in located}
+  points = [unit_vector(c.lat, c.lon) for c in located]
+  moved = [i for i, c in enumerate(located) if cache.get(c.slug, {}).get("at") != [c.lat, c.lon]]
+  stale = {located[i].slug for i in moved} | (cache.keys() - by_slug.keys())
+  changed = KDTree([points[i] for i in moved]) if cache and moved else None
+
+  tree = None  # full index, built only if some list has to be recomputed
+  nearby, new_cache, recomputed = {}, {}, 0
+  for i, c in enumerate(located):
+    entry = cache.get(c.slug)
+    if (
+      entry is None
+      or c.slug in stale
+      or len(entry["near"]) != k
+      or any(slug in stale for slug in entry["near"])
+      or (changed is not None and changed.nearest(points[i], 1)[0][0] <= entry["r"])
+    ):
+      tree = tree or KDTree(points)
+      found = tree.nearest(points[i], k, exclude=i)
+      entry = {"at": [c.lat, c.lon], "near": [located[j].slug for _, j in found], "r": found[-1][0]}
+      recomputed += 1
+    new_cache[c.slug] = entry
+    nearby[c.slug] = tuple(by_slug[slug] for slug in entry["near"])
+  return nearby, new_cache, recomputed
+
+
+# -----------------------
+# BUILD MANIFEST (incremental builds)
+# -----------------------
+MANIFEST_VERSION = 2
+
+# SiteConfig fields read by make_page() for every page (nav, brand, image, footer).
+LAYOUT_FIELDS = (
+  "brand_name", "cta_text", "cta_href", "image_filename", "external_css", "site_origin",
+  "responsive_images", "image_sizes", "prune_css", "minify",
+)
+
+# SiteConfig fields each page kind reads on top of the layout.
+PAGE_FIELDS: dict[str, tuple[str, ...]] = {
+  "home": ("h1_title", "h1_sub", "main_h2", "main_p", "site_origin"),
+  "state": ("h1_short", "h1_sub", "site_origin", "subdomain_base", "state_page_size"),
+  "cost": ("cost_title", "cost_sub", "cost_h2", "cost_p", "site_origin"),
+  "howto": ("howto_title", "howto_sub", "howto_h2", "howto_p", "site_origin"),
+  "contact": ("site_origin", "networx_facade"),
+  "contact_form": (),
+  "city": (
+    "h1_short", "h1_sub", "main_h2", "main_p", "location_cost_h2", "location_cost_p",
+    "cost_low", "cost_high", "site_origin", "subdomain_base", "nearby_h2",
+  ),
+  "city_cost": (
+    "cost_title", "cost_sub", "cost_h2", "cost_p", "cost_low", "cost_high",
+    "site_origin", "subdomain_base",
+  ),
+}
+
+PAGE_RENDERERS = {
+  "home": homepage_html,
+  "cost": cost_page_html,
+  "howto": howto_page_html,
+  "contact": contact_page_html,
+  "contact_form": contact_form_page_html,
+  "state": state_page_html,
+  "city": city_page_html,
+  "city_cost": city_cost_page_html,
+}
+
+# Pages left out of the sitemap (noindex helpers).
+SITEMAP_EXCLUDED_KINDS = frozenset({"contact_form"})
+
+
+@cache
+def template_version() -> str:
+  """
+  Hash of this file: any template/code change invalidates every page.
+  """
+  return file_digest(Path(__file__).resolve())
+
+
+def config_fields(names: tuple[str, ...]) -> dict[str, object]:
+  return {name: getattr(CONFIG, name) for name in names}
+
+
+@dataclass(frozen=True)
+class PageJob:
+  path: str  # relative to output_dir, posix style
+  kind: str  # key into PAGE_RENDERERS
+  url: str  # canonical URL
+  args: tuple = ()
+  key: str = ""  # digest of everything the page reads
+
+  def html(self) -> str:
+    """
+    The page before --minify.
+    """
+    page = PAGE_RENDERERS[self.kind](*self.args)
+    return prune_page_css(page) if CONFIG.prune_css else page
+
+  def render(self) -> str:
+    page = self.html()
+    return minify_html(page) if CONFIG.minify else page
+
+
+def site_pages(cities: tuple[City, ...], nearby: dict[str, tuple[City, ...]] | None = None) -> list[PageJob]:
+  """
+  Every HTML page of the site, each keyed by a hash of its inputs.
+  nearby=None computes the nearby-city lists from scratch.
+  """
+  if nearby is None:
+    nearby = nearby_cities(cities, CONFIG.nearby_count)[0]
+  images = current_image_set()
+  layout = digest(
+    template_version(),
+    CSS,
+    config_fields(LAYOUT_FIELDS),
+    [v.path for v in images.variants] if images else None,
+    image_size(source_image_path()),
+  )
+
+  # Per-kind part of the key, hashed once rather than once per page.
+  kind_keys = {kind: digest(layout, kind, config_fields(fields)) for kind, fields in PAGE_FIELDS.items()}
+
+  def job(path: str, kind: str, url: str, args: tuple = (), inputs: object = None) -> PageJob:
+    key = digest(kind_keys[kind], inputs)
+    return PageJob(path=path, kind=kind, url=url, args=args, key=key)
+
+  states = cities_by_state(cities)
+
+  # The homepage lists every state (not every city).
+  jobs = [
+    job("index.html", "home", root_url("/"), inputs=[state for state, _ in states]),
+    job("cost/index.html", "cost", root_url("/cost/")),
+    job("how-to/index.html", "howto", root_url("/how-to/")),
+    job("contact/index.html", "contact", root_url("/contact/")),
+  ]
+  if CONFIG.networx_facade:
+    jobs.append(job(f"{CONTACT_FORM_PATH.strip('/')}/index.html", "contact_form", root_url(CONTACT_FORM_PATH)))
+
+  # State hubs: CONFIG.state_page_size cities per page.
+  size = max(1, CONFIG.state_page_size)
+  for state, members in states:
+    pages = -(-len(members) // size)
+    for page in range(1, pages + 1):
+      chunk = members[(page - 1) * size:page * size]
+      path = f"states/{slugify(state)}/" + ("" if page == 1 else f"page/{page}/") + "index.html"
+      inputs = (state, page, pages, [(c.name, c.state) for c in chunk])
+      jobs.append(job(path, "state", state_url(state, page), (state, page, pages, chunk), inputs))
 
   # City pages: still generated as /<slug>/index.html
   # (Vercel host-rewrite should route subdomain -> /<slug>/ behind the scenes.)
-  for city, state, col in CITIES:
-    slug = city_state_slug(city, state)
-
-    write_text(out / slug / "index.html", city_page_html(city, state, col))
-    write_text(out / slug / "cost" / "index.html", city_cost_page_html(city, state, col))
-
-  # Sitemap:
-  # - root pages absolute on apex
-  # - city pages absolute subdomains
-  urls: list[str] = [
-    root_url("/"),
-    root_url("/cost/"),
-    root_url("/how-to/"),
-    root_url("/contact/"),
+  for c in cities:
+    row = c.row()
+    near = nearby.get(c.slug, ())
+    jobs.append(job(f"{c.slug}/index.html", "city", c.url, (c, near), (row, [(n.name, n.state) for n in near])))
+    jobs.append(job(f"{c.slug}/cost/index.html", "city_cost", c.url + "cost/", (c,), row))
+
+  return jobs
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+  """
+  Carry an unchanged file into the staging tree without rewriting it.
+  """
+  if src == dst:  # in-place build: already there
+    return
+  dst.parent.mkdir(parents=True, exist_ok=True)
+  dst.unlink(missing_ok=True)  # a reused staging tree may hold an older copy
+  try:
+    os.link(src, dst)
+  except OSError:  # no hard links here (e.g. across filesystems)
+    shutil.copy2(src, dst)
+
+
+def replace_file(path: Path, data: bytes) -> None:
+  """
+  Write via a temp file + rename, so a file that is hard-linked into another
+  build (or being served) is replaced rather than truncated.
+  """
+  path.parent.mkdir(parents=True, exist_ok=True)
+  tmp = path.with_name(path.name + ".tmp")
+  tmp.write_bytes(data)
+  os.replace(tmp, path)
+
+
+def write_if_changed(
+  live: Path, stage: Path, path: str, data: bytes, prev_hash: str | None, staged: bool = False
+) -> tuple[str, bool]:
+  """
+  Put `data` at stage/path. If the manifest says the live build already holds
+  these bytes, the live file is hard-linked instead of written (or left alone
+  when `staged`: the staging tree already holds the live copy).
+  Returns (sha256 of data, whether the file was written).
+  """
+  out_hash = hashlib.sha256(data).hexdigest()
+  if out_hash == prev_hash and (staged or (live / path).exists()):
+    if not staged:
+      link_or_copy(live / path, stage / path)
+    return out_hash, False
+  replace_file(stage / path, data)
+  return out_hash, True
+
+
+def render_shard(
+  live: Path, stage: Path, shard: list[tuple[PageJob, str | None, bool]]
+) -> tuple[list[tuple[str, bool]], dict[str, object]]:
+  """
+  Render and write a slice of pages. Runs in the parent for serial builds and
+  in pool workers for --jobs builds, so both produce the same bytes.
+  Also returns this slice's render/write seconds and fragment cache hits/misses.
+  """
+  before = fragment_cache_stats()
+  results = []
+  render_s = write_s = 0.0
+  for job, prev_hash, staged in shard:
+    t0 = time.perf_counter()
+    data = job.render().encode("utf-8")
+    t1 = time.perf_counter()
+    results.append(write_if_changed(live, stage, job.path, data, prev_hash, staged))
+    render_s += t1 - t0
+    write_s += time.perf_counter() - t1
+
+  after = fragment_cache_stats()
+  fragments = {
+    name: [hits - before[name][0], misses - before[name][1]]
+    for name, (hits, misses) in after.items()
+  }
+  return results, {"render_s": render_s, "write_s": write_s, "fragments": fragments}
+
+
+def load_manifest(path: Path, section: str = "files") -> dict[str, dict]:
+  """
+  One section of the manifest: "files" (per-output hashes) or a build cache
+  such as "neighbors".
+  """
+  try:
+    data = json.loads(path.read_text(encoding="utf-8"))
+  except (FileNotFoundError, ValueError):
+    return {}
+  if data.get("version") != MANIFEST_VERSION:
+    return {}
+  return data.get(section, {})
+
+
+def load_staging_state(path: Path) -> set[str] | None:
+  """
+  Paths where the parked staging tree may differ from the live build, as
+  left by the last IncrementalBuild.finish(); None = unknown, rebuild the
+  staging tree. The file is consumed, so an interrupted build never trusts
+  a half-updated staging tree.
+  """
+  try:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    path.unlink()
+  except (FileNotFoundError, ValueError):
+    return None
+  if data.get("version") != MANIFEST_VERSION:
+    return None
+  return set(data["dirty"])
+
+
+def save_staging_state(path: Path, dirty: set[str]) -> None:
+  path.write_text(json.dumps({"version": MANIFEST_VERSION, "dirty": sorted(dirty)}), encoding="utf-8")
+
+
+def set_aside(path: Path) -> Path:
+  """
+  Rename a tree out of the way (one rename) so it can be deleted later, off
+  the build's critical path. Returns the directory now holding it.
+  """
+  trash = Path(tempfile.mkdtemp(prefix=f".{path.name}.", dir=path.parent))
+  os.rename(path, trash / path.name)
+  return trash
+
+
+def remove_paths(root: Path, paths) -> None:
+  """
+  Delete root/path for each path, then any directories left empty.
+  """
+  for path in paths:
+    target = root / path
+    target.unlink(missing_ok=True)
+    for parent in target.parents:
+      if parent == root or not parent.is_dir() or any(parent.iterdir()):
+        break
+      parent.rmdir()
+
+
+def save_manifest(path: Path, files: dict[str, dict[str, str]], **sections: dict) -> None:
+  tmp = path.with_name(path.name + ".tmp")
+  tmp.write_text(
+    json.dumps({"version": MANIFEST_VERSION, "files": files, **sections}, indent=1, sort_keys=True),
+    encoding="utf-8",
+  )
+  os.replace(tmp, path)
+
+
+def exchange_paths(a: Path, b: Path) -> bool:
+  """
+  Atomically swap two directories (Linux renameat2 RENAME_EXCHANGE).
+  Returns False where the kernel/libc/filesystem does not support it.
+  """
+  try:
+    renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+  except (OSError, AttributeError):
+    return False
+  at_fdcwd, rename_exchange = -100, 2
+  if renameat2(at_fdcwd, os.fsencode(a), at_fdcwd, os.fsencode(b), rename_exchange) == 0:
+    return True
+  err = ctypes.get_errno()
+  if err in (errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+    return False
+  raise OSError(err, os.strerror(err), str(a), None, str(b))
+
+
+def swap_into_place(new: Path, out: Path) -> Path | None:
+  """
+  Make `new` live at `out`; returns where the replaced tree now lives.
+  Readers of `out` see either the old or the new tree, never a partial one
+  (a two-rename fallback leaves a sub-millisecond gap without renameat2).
+  """
+  if not out.exists():
+    os.rename(new, out)
+    return None
+  if exchange_paths(new, out):
+    return new
+  old = out.with_name(out.name + ".old")
+  if old.exists():
+    shutil.rmtree(old)
+  os.rename(out, old)
+  os.rename(new, out)
+  return old
+
+
+def previous_build_paths(out: Path, manifest_path: Path) -> tuple[Path, Path]:
+  return out.with_name(out.name + ".prev"), manifest_path.with_name(manifest_path.name + ".prev")
+
+
+def rollback(out: Path, manifest_path: Path) -> None:
+  """
+  Swap the live build with the one kept by --keep-previous (and their manifests).
+  """
+  prev_dir, prev_manifest = previous_build_paths(out, manifest_path)
+  if not prev_dir.exists():
+    raise FileNotFoundError(f"No previous build to roll back to: {prev_dir}")
+  displaced = swap_into_place(prev_dir, out)
+  if displaced is not None and displaced != prev_dir:
+    os.rename(displaced, prev_dir)
+  # The parked staging tree was diffed against the build just swapped out.
+  out.with_name(out.name + ".staging.json").unlink(missing_ok=True)
+
+  if prev_manifest.exists():
+    tmp = manifest_path.with_name(manifest_path.name + ".swap")
+    os.replace(manifest_path, tmp)
+    os.replace(prev_manifest, manifest_path)
+    os.replace(tmp, prev_manifest)
+
+
+class IncrementalBuild:
+  """
+  Builds into a sibling staging directory (`<out>.staging`) and swaps it over
+  `out` in finish(), so readers of `out` never see a half-written site.
+
+  Anything whose input hash matches the previous build's manifest is
+  hard-linked from the live tree instead of re-rendered or rewritten; files
+  the new build no longer emits simply are not carried over. Without a usable
+  manifest (first run, --full, version bump) everything is written.
+
+  The tree swapped out by finish() is parked as the next build's staging
+  tree, with the list of paths where it differs from the new live build
+  (`<out>.staging.json`). The next build only re-links or deletes those
+  paths and its own changes, so a no-op rebuild touches almost no files.
+
+  in_place=True skips staging: changed files are replaced directly in `out`
+  and stale ones deleted, so a rebuild costs O(changed files) (dev server).
+  """
+
+  def __init__(
+    self,
+    out: Path,
+    manifest_path: Path,
+    *,
+    full: bool = False,
+    keep_previous: bool = False,
+    in_place: bool = False,
+  ) -> None:
+    self.out = out
+    self.in_place = in_place
+    self.stage = out if in_place else out.with_name(out.name + ".staging")
+    self.state_path = out.with_name(out.name + ".staging.json")
+    self.manifest_path = manifest_path
+    self.keep_previous = keep_previous
+    # What the live tree holds; --full just refuses to reuse any of it.
+    self.live = load_manifest(manifest_path) if out.exists() else {}
+    self.previous = {} if full else self.live
+    self.files: dict[str, dict[str, str]] = {}
+    self.sections: dict[str, dict] = {}  # extra manifest sections (build caches)
+    self.build_date = CONFIG.build_day()
+    self.written = 0
+    self.unchanged = 0
+    self.pruned = 0
+    self.fragment_stats: dict[str, list[int]] = {}
+    self.render_s = 0.0  # summed over workers, so may exceed wall time with --jobs
+    self.write_s = 0.0
+
+    # Paths where the staging tree may not hold the live copy; None = the
+    # staging tree starts empty. In place, the staging tree is the live one.
+    self.dirty: set[str] | None = set() if in_place else None
+    self.trash: list[Path] = []  # trees set aside, deleted once the build is live
+
+    if in_place and full:
+      reset_output_dir(out)
+    elif in_place:
+      out.mkdir(parents=True, exist_ok=True)
+    else:
+      dirty = load_staging_state(self.state_path)
+      if self.live and dirty is not None and self.stage.is_dir():
+        self.dirty = dirty
+      else:
+        # Unknown contents (first run, --full, interrupted build).
+        if self.stage.exists():
+          self.trash.append(set_aside(self.stage))
+        self.stage.mkdir(parents=True)
+
+  def staged(self, path: str) -> bool:
+    """
+    Whether stage/path already holds the live build's copy of path.
+    """
+    return self.dirty is not None and path not in self.dirty
+
+  def carry(self, path: str) -> None:
+    """
+    Make stage/path the live build's copy of path.
+    """
+    if not self.staged(path):
+      link_or_copy(self.out / path, self.stage / path)
+
+  def is_current(self, path: str, key: str) -> bool:
+    prev = self.previous.get(path)
+    if prev is None or prev["input"] != key or not os.path.exists(os.path.join(self.out, path)):
+      return False
+    self.carry(path)
+    self.files[path] = prev
+    self.unchanged += 1
+    return True
+
+  def record(self, path: str, key: str, out_hash: str, wrote: bool) -> None:
+    # lastmod only moves when the output bytes change (drives sitemap <lastmod>).
+    prev = self.previous.get(path)
+    lastmod = prev["lastmod"] if prev is not None and prev["output"] == out_hash else self.build_date
+    self.files[path] = {"input": key, "output": out_hash, "lastmod": lastmod}
+    if wrote:
+      self.written += 1
+    else:
+      self.unchanged += 1
+
+  def write(self, path: str, content: str) -> None:
+    prev = self.previous.get(path)
+    out_hash, wrote = write_if_changed(
+      self.out, self.stage, path, content.encode("utf-8"), prev and prev["output"], self.staged(path)
+    )
+    self.record(path, out_hash, out_hash, wrote)
+
+  def pages(self, jobs: list[PageJob], *, workers: int = 1) -> None:
+    """
+    Render every page whose inputs changed. With workers > 1 the pending pages
+    are sharded across a process pool; each worker renders and writes its
+    shard and the parent records the resulting hashes in job order.
+    """
+    pending = [
+      (job, self.previous[job.path]["output"] if job.path in self.previous else None, self.staged(job.path))
+      for job in jobs
+      if not self.is_current(job.path, job.key)
+    ]
+
+    if workers <= 1 or len(pending) < 2:
+      done = [render_shard(self.out, self.stage, pending)]
+    else:
+      # Several shards per worker keeps the pool busy when pages differ in cost.
+      size = max(1, -(-len(pending) // (workers * 4)))
+      shards = [pending[i:i + size] for i in range(0, len(pending), size)]
+      with ProcessPoolExecutor(
+        max_workers=workers, initializer=set_site, initargs=(CONFIG, get_cities())
+      ) as pool:
+        n = len(shards)
+        done = list(pool.map(render_shard, [self.out] * n, [self.stage] * n, shards))
+
+    results = []
+    for shard_results, shard_stats in done:
+      results += shard_results
+      self.render_s += shard_stats["render_s"]
+      self.write_s += shard_stats["write_s"]
+      for name, (hits, misses) in shard_stats["fragments"].items():
+        total = self.fragment_stats.setdefault(name, [0, 0])
+        total[0] += hits
+        total[1] += misses
+
+    for (job, _, _), (out_hash, wrote) in zip(pending, results):
+      self.record(job.path, job.key, out_hash, wrote)
+
+  def copy(self, path: str, src: Path) -> None:
+    key = file_digest(src)
+    if not self.is_current(path, key):
+      replace_file(self.stage / path, src.read_bytes())
+      self.record(path, key, key, True)
+
+  def compress(self, *, workers: int = 1) -> None:
+    """
+    Write .gz/.br siblings for every compressible output. Siblings are keyed
+    by their source's output hash, so only changed files are recompressed, and
+    they are pruned with their source (or when --compress is dropped).
+    """
+    encodings = available_encodings()
+    pending: list[tuple[str, str]] = []  # (source path, encoding)
+    for path, entry in list(self.files.items()):
+      if Path(path).suffix not in COMPRESSIBLE_SUFFIXES:
+        continue
+      for enc in encodings:
+        if not self.is_current(path + COMPRESSED_SUFFIX[enc], entry["output"]):
+          pending.append((path, enc))
+
+    if workers <= 1 or len(pending) < 2:
+      results = [compress_file(self.stage, path, enc) for path, enc in pending]
+    else:
+      paths, encs = zip(*pending)
+      chunk = max(1, len(pending) // (workers * 4))
+      with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(compress_file, [self.stage] * len(pending), paths, encs, chunksize=chunk))
+
+    for (path, enc), out_hash in zip(pending, results):
+      self.record(path + COMPRESSED_SUFFIX[enc], self.files[path]["output"], out_hash, True)
+
+  def finish(self) -> None:
+    """
+    Publish the staged tree and its manifest. The replaced build is kept as
+    `<out>.prev` (with `<manifest>.prev`) for rollback, or parked as the next
+    build's staging tree.
+    """
+    stale = self.previous.keys() - self.files.keys()
+    self.pruned = len(stale)
+    if self.in_place:
+      remove_paths(self.out, stale)
+      save_manifest(self.manifest_path, self.files, **self.sections)
+      return
+
+    if self.dirty is not None:
+      # A reused staging tree still holds the old build's copies of these.
+      remove_paths(self.stage, (self.live.keys() | self.dirty) - self.files.keys())
+
+    prev_dir, prev_manifest = previous_build_paths(self.out, self.manifest_path)
+
+    old = swap_into_place(self.stage, self.out)
+    parked = False
+    if old is not None and self.keep_previous:
+      if prev_dir.exists():
+        self.trash.append(set_aside(prev_dir))
+      os.rename(old, prev_dir)
+      if self.manifest_path.exists():
+        os.replace(self.manifest_path, prev_manifest)
+    elif old is not None:
+      if old != self.stage:
+        os.rename(old, self.stage)
+      # Without a manifest the parked tree's contents are unknown; the next
+      # build then starts its staging tree afresh.
+      parked = bool(self.live)
+
+    save_manifest(self.manifest_path, self.files, **self.sections)
+    if parked:
+      # The parked tree is the previous build: it differs from the new one
+      # exactly where an output hash changed, appeared or went away.
+      save_staging_state(self.state_path, (self.live.keys() - self.files.keys()) | {
+        path for path, entry in self.files.items()
+        if path not in self.live or self.live[path]["output"] != entry["output"]
+      })
+    if self.trash:
+      # The new build is already live; the interpreter waits for this at exit.
+      threading.Thread(target=lambda: [shutil.rmtree(t, ignore_errors=True) for t in self.trash]).start()
+
+
+class SitemapWriter:
+  """
+  Streams <url> entries straight to disk as sitemap-N.xml shards of at most
+  `max_urls` URLs, then writes the sitemap.xml index. Memory stays bounded by one
+  open file regardless of city count, and an unchanged shard keeps its file
+  and <lastmod> so crawlers can skip it.
+  """
+
+  def __init__(self, build: IncrementalBuild, *, max_urls: int = SITEMAP_MAX_URLS) -> None:
+    self.build = build
+    self.max_urls = max_urls
+    self.shards: list[tuple[str, str]] = []  # (path, lastmod)
+    self._file = None
+
+  def add(self, url: str, lastmod: str) -> None:
+    if self._file is None or self._count >= self.max_urls:
+      self._close_shard()
+      self._open_shard()
+    self._emit(sitemap_url_xml(url, lastmod))
+    self._count += 1
+
+  def close(self) -> None:
+    self._close_shard()
+    self.build.write(SITEMAP_INDEX, sitemap_index_xml(self.shards))
+
+  def _open_shard(self) -> None:
+    self._path = f"sitemap-{len(self.shards) + 1}.xml"
+    self._tmp = self.build.stage / (self._path + ".tmp")
+    self._file = self._tmp.open("wb")
+    self._hash = hashlib.sha256()
+    self._count = 0
+    self._emit(SITEMAP_HEAD)
+
+  def _emit(self, text: str) -> None:
+    data = text.encode("utf-8")
+    self._file.write(data)
+    self._hash.update(data)
+
+  def _close_shard(self) -> None:
+    if self._file is None:
+      return
+    self._emit(SITEMAP_TAIL)
+    self._file.close()
+    self._file = None
+
+    out_hash = self._hash.hexdigest()
+    prev = self.build.previous.get(self._path)
+    live = self.build.out / self._path
+    if prev is not None and prev["output"] == out_hash and live.exists():
+      self._tmp.unlink()
+      self.build.carry(self._path)
+      wrote = False
+    else:
+      os.replace(self._tmp, self.build.stage / self._path)
+      wrote = True
+
+    self.build.record(self._path, out_hash, out_hash, wrote)
+    self.shards.append((self._path, self.build.files[self._path]["lastmod"]))
+
+
+# -----------------------
+# PRECOMPRESSION
+# -----------------------
+COMPRESSIBLE_SUFFIXES = {".html", ".xml", ".css", ".txt"}
+COMPRESSED_SUFFIX = {"gzip": ".gz", "br": ".br"}
+
+
+def available_encodings() -> tuple[str, ...]:
+  return ("gzip", "br") if brotli is not None else ("gzip",)
+
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+  if encoding == "gzip":
+    # mtime=0 keeps the .gz byte-identical across rebuilds of the same source.
+    return gzip.compress(data, compresslevel=9, mtime=0)
+  return brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)
+
+
+def compress_file(out: Path, path: str, encoding: str) -> str:
+  """
+  Write the `encoding` sibling of out/path; returns its sha256.
+  """
+  data = compress_bytes((out / path).read_bytes(), encoding)
+  replace_file(out / (path + COMPRESSED_SUFFIX[encoding]), data)
+  return hashlib.sha256(data).hexdigest()
+
+
+# -----------------------
+# SERVING (devserver.py, packserver.py)
+# -----------------------
+REVALIDATE_CACHE_CONTROL = "public, max-age=0, must-revalidate"  # devserver: edits show on reload
+CONTENT_TYPES = {
+  ".html": "text/html; charset=utf-8",
+  ".xml": "application/xml; charset=utf-8",
+  ".css": "text/css; charset=utf-8",
+  ".txt": "text/plain; charset=utf-8",
+  ".json": "application/json",
+  ".png": "image/png",
+  ".jpeg": "image/jpeg",
+  ".jpg": "image/jpeg",
+  ".webp": "image/webp",
+  ".avif": "image/avif",
+}
+
+
+def content_type(path: str) -> str:
+  return CONTENT_TYPES.get(posixpath.splitext(path)[1], "application/octet-stream")
+
+
+def cache_control(path: str) -> str:
+  # Hashed assets never change; everything else as vercel.json / _headers.
+  return IMMUTABLE_CACHE_CONTROL if path.lstrip("/").startswith("assets/") else CONFIG.page_cache_control
+
+
+def route_host(host: str, path: str, subdomain_base: str | None = None) -> str:
+  """
+  Request Host + URL path -> path in the site tree, mirroring the vercel.json
+  rewrite: <slug>.<SUBDOMAIN_BASE>/x -> /<slug>/x. <slug>.localhost works too
+  (browsers resolve it to 127.0.0.1); www. and the apex serve the root, as
+  do shared_paths() on every host.
+  """
+  if is_shared_path(path):
+    return path
+  base = (subdomain_base or CONFIG.subdomain_base).lower()
+  host = host.rsplit(":", 1)[0].lower().rstrip(".")
+  for suffix in (base, "localhost"):
+    if host.endswith("." + suffix):
+      label = host[: -len(suffix) - 1]
+      if label and label != "www" and "." not in label:
+        return f"/{label}{path}"
+  return path
+
+
+def host_redirect(
+  host: str, target: str, slug_re: str, site_origin: str | None = None, subdomain_base: str | None = None
+) -> str | None:
+  """
+  Location of the 308 vercel.json answers before any rewrite, or None:
+  www.<apex> -> the apex, and apex /<slug>/... -> the city subdomain.
+  `target` is the request target (path + query); the query is kept.
+  """
+  origin = (site_origin or CONFIG.site_origin).rstrip("/")
+  apex = origin.split("://", 1)[-1].split("/", 1)[0].lower()
+  host = host.rsplit(":", 1)[0].lower().rstrip(".")
+  path, sep, query = target.partition("?")
+  if host == f"www.{apex}":
+    return origin + path + sep + query
+  if host == apex:
+    m = re.fullmatch(rf"/({slug_re})(?:/(.*))?", path)
+    if m:
+      base = (subdomain_base or CONFIG.subdomain_base).strip().lstrip(".")
+      return f"https://{m[1]}.{base}/" + (m[2] or "") + sep + query
+  return None
+
+
+def accepted_encodings(header: str) -> set[str]:
+  """
+  Content codings an Accept-Encoding header allows (q=0 means refused).
+  """
+  accepted = set()
+  for part in header.split(","):
+    name, _, params = part.partition(";")
+    if params.replace(" ", "").lower() in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+      continue
+    accepted.add(name.strip().lower())
+  return accepted
+
+
+def tree_path(path: str) -> str:
+  """
+  Routed URL path -> file path relative to the site root; directories map to
+  their index.html. Dot segments cannot climb above the root.
+  """
+  rel = posixpath.normpath("/" + path).lstrip("/")
+  if path.endswith("/"):
+    return f"{rel}/index.html" if rel else "index.html"
+  return rel
+
+
+def response_head(path: str, length: int, encoding: str = "identity", etag: str | None = None) -> bytes:
+  """
+  Status line + headers of a 200 response for `path` (HTTP/1.1, CRLF-terminated).
+  """
+  lines = [
+    "HTTP/1.1 200 OK",
+    f"Content-Type: {content_type(path)}",
+    f"Content-Length: {length}",
+    f"Cache-Control: {cache_control(path)}",
   ]
-  urls += [city_url(c, s) for c, s, _ in CITIES]
+  if posixpath.splitext(path)[1] in COMPRESSIBLE_SUFFIXES:
+    lines.append("Vary: Accept-Encoding")
+  if encoding != "identity":
+    lines.append(f"Content-Encoding: {encoding}")
+  if etag:
+    lines.append(f'ETag: "{etag}"')
+  return ("\r\n".join(lines) + "\r\n\r\n").encode("ascii")
+
+
+def not_modified_head(path: str, etag: str) -> bytes:
+  """
+  304 response for `path` when the client already holds `etag`: the caching
+  headers of its 200, no body (and so no Content-Length).
+  """
+  lines = ["HTTP/1.1 304 Not Modified", f"Cache-Control: {cache_control(path)}"]
+  if posixpath.splitext(path)[1] in COMPRESSIBLE_SUFFIXES:
+    lines.append("Vary: Accept-Encoding")
+  lines.append(f'ETag: "{etag}"')
+  return ("\r\n".join(lines) + "\r\n\r\n").encode("ascii")
+
+
+# -----------------------
+# LIBRARY API
+# -----------------------
+ARCHIVE_DATE_TIME = (1980, 1, 1, 0, 0, 0)  # earliest zip timestamp; fixed so bundles are reproducible
+ARCHIVE_MTIME = 315532800  # the same instant as a unix time, for tar members
+BUNDLE_MANIFEST = "bundle-manifest.json"  # last archive member: sha256 + size of every file
+
+
+class OutputSink(ABC):
+  """
+  Destination for build_site(): receives every output file as (path, bytes),
+  with paths relative to the site root.
+  """
+
+  @abstractmethod
+  def write(self, path: str, data: bytes) -> None:
+    ...
+
+  def close(self) -> None:
+    pass
+
+
+class MemorySink(dict, OutputSink):
+  """
+  Keeps the build in memory as {path: bytes}.
+  """
+
+  def write(self, path: str, data: bytes) -> None:
+    self[path] = data
+
+
+class DirectorySink(OutputSink):
+  """
+  Plain (non-incremental) directory output.
+  """
+
+  def __init__(self, root: Path) -> None:
+    self.root = Path(root)
+
+  def write(self, path: str, data: bytes) -> None:
+    out_path = self.root / path
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_bytes(data)
+
+
+class ArchiveSink(OutputSink):
+  """
+  Streams files into a .zip, .tar or .tar.gz/.tgz (picked by suffix) with
+  fixed timestamps and permissions, in the order they are written (build
+  order is deterministic). On close a manifest of content hashes is added as
+  the last member so uploaders can diff without unpacking.
+  """
+
+  def __init__(self, path: Path, *, manifest_name: str | None = BUNDLE_MANIFEST) -> None:
+    self.path = Path(path)
+    self.manifest_name = manifest_name
+    self.hashes: dict[str, dict[str, object]] = {}
+    name = self.path.name
+    self._zip = self._tar = self._gz = self._raw = None
+
+    if name.endswith(".zip"):
+      self._zip = zipfile.ZipFile(self.path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=9)
+    elif name.endswith((".tar", ".tar.gz", ".tgz")):
+      self._raw = self.path.open("wb")
+      fileobj = self._raw
+      if not name.endswith(".tar"):
+        # GzipFile directly: tarfile's "w:gz" would stamp the current time.
+        self._gz = fileobj = gzip.GzipFile(filename="", fileobj=self._raw, mode="wb", mtime=0)
+      self._tar = tarfile.open(fileobj=fileobj, mode="w", format=tarfile.PAX_FORMAT)
+    else:
+      raise ValueError(f"Unsupported archive type (use .zip, .tar, .tar.gz or .tgz): {self.path}")
+
+  def write(self, path: str, data: bytes) -> None:
+    self.hashes[path] = {"sha256": hashlib.sha256(data).hexdigest(), "size": len(data)}
+    self._add(path, data)
+
+  def _add(self, path: str, data: bytes) -> None:
+    if self._zip is not None:
+      info = zipfile.ZipInfo(path, date_time=ARCHIVE_DATE_TIME)
+      info.compress_type = zipfile.ZIP_DEFLATED
+      info.external_attr = 0o644 << 16
+      self._zip.writestr(info, data)
+    else:
+      info = tarfile.TarInfo(path)
+      info.size = len(data)
+      info.mtime = ARCHIVE_MTIME
+      info.mode = 0o644
+      self._tar.addfile(info, io.BytesIO(data))
+
+  def close(self) -> None:
+    if self.manifest_name and (self._zip or self._tar):
+      manifest = {"version": 1, "files": self.hashes}
+      self._add(self.manifest_name, (json.dumps(manifest, indent=1) + "\n").encode("utf-8"))
+    for handle in (self._zip, self._tar, self._gz, self._raw):
+      if handle is not None:
+        handle.close()
+    self._zip = self._tar = self._gz = self._raw = None
+
+
+@contextmanager
+def site_context(config: SiteConfig, cities: tuple[City, ...] | None = None):
+  """
+  Temporarily make `config`/`cities` the active site.
+  """
+  saved = (CONFIG, _CITIES)
+  set_site(config, cities)
+  try:
+    yield
+  finally:
+    set_site(*saved)
+
+
+def site_assets() -> list[tuple[str, Path | str]]:
+  """
+  Non-page outputs as (path, source file to copy) or (path, text).
+  """
+  src_image = source_image_path()
+  if not src_image.exists():
+    raise FileNotFoundError(f"Missing image next to generate.py: {src_image}")
+  assets: list[tuple[str, Path | str]] = [(CONFIG.image_filename, src_image)]
+
+  images = current_image_set()
+  if images is not None:
+    assets += ensure_image_variants(src_image, images, CONFIG.image_cache_dir).items()
+  if CONFIG.external_css:
+    css = site_css()
+    assets.append((css_asset_path(css), css + "\n"))
+  return assets
+
+
+def sitemap_files(entries, *, max_urls: int = SITEMAP_MAX_URLS):
+  """
+  In-memory counterpart of SitemapWriter: yields (path, xml) for each shard of
+  (url, lastmod) entries, then the index.
+  """
+  shards: list[tuple[str, str]] = []
+  lines: list[str] = []
+  lastmod = ""
+  for url, url_lastmod in entries:
+    lines.append(sitemap_url_xml(url, url_lastmod))
+    lastmod = max(lastmod, url_lastmod)
+    if len(lines) == max_urls:
+      shards.append((f"sitemap-{len(shards) + 1}.xml", lastmod))
+      yield shards[-1][0], SITEMAP_HEAD + "".join(lines) + SITEMAP_TAIL
+      lines, lastmod = [], ""
+  if lines:
+    shards.append((f"sitemap-{len(shards) + 1}.xml", lastmod))
+    yield shards[-1][0], SITEMAP_HEAD + "".join(lines) + SITEMAP_TAIL
+  yield SITEMAP_INDEX, sitemap_index_xml(shards)
+
+
+def site_files(cities: tuple[City, ...]):
+  """
+  Every output of a full build as (path, bytes), in a deterministic order.
+  """
+  for path, src in site_assets():
+    yield path, src.read_bytes() if isinstance(src, Path) else src.encode("utf-8")
+
+  # <lastmod> follows the page bytes, as in IncrementalBuild.record(): a page
+  # whose output hash matches the last build's manifest keeps its date.
+  previous = load_manifest(CONFIG.manifest_path)
+  today = CONFIG.build_day()
+  lastmods: dict[str, str] = {}
+  jobs = site_pages(cities)
+  for job in jobs:
+    data = job.render().encode("utf-8")
+    prev = previous.get(job.path)
+    lastmods[job.path] = prev["lastmod"] if prev and prev["output"] == hashlib.sha256(data).hexdigest() else today
+    yield job.path, data
+  for path, text in host_files():
+    yield path, text.encode("utf-8")
+
+  listed = (job for job in jobs if job.kind not in SITEMAP_EXCLUDED_KINDS)
+  for path, xml in sitemap_files((job.url, lastmods[job.path]) for job in listed):
+    yield path, xml.encode("utf-8")
+  yield "robots.txt", robots_txt().encode("utf-8")
+
+
+def build_site(
+  config: SiteConfig | None = None,
+  cities: tuple[City, ...] | None = None,
+  *,
+  sink: OutputSink | None = None,
+) -> OutputSink:
+  """
+  Render the whole site in-process, without touching CONFIG.output_dir or the
+  build manifest. Returns the sink it wrote to: by default a MemorySink, i.e.
+  a dict of path -> bytes. cities=None loads config.cities_csv lazily.
+  """
+  sink = MemorySink() if sink is None else sink
+  with site_context(config or CONFIG, cities):
+    try:
+      for path, data in site_files(get_cities()):
+        sink.write(path, data)
+    finally:
+      sink.close()
+  return sink
+
+
+PACK_MAGIC = b"SITEPAK1"
+PACK_HEADER = struct.Struct("<8sQQ")  # magic, index offset, index length
+PACK_VERSION = 3
+
+
+class PackSink(OutputSink):
+  """
+  Packs the site into one indexed file for packserver.py. Every entry is a
+  complete HTTP/1.1 response (headers from response_head(), then the body),
+  so a server answers with one zero-copy sendfile() of a single byte range.
+  .gz/.br files written after their source become that path's encoded
+  variants. A JSON index is appended on close:
+    {"entries": {path: {encoding: [offset, head_len, body_len, etag]}},
+     "files": {path: {"sha256", "size"}},
+     "site_origin", "subdomain_base", "city_slug_re": for host routing}
+  """
+
+  def __init__(self, path: Path) -> None:
+    self.path = Path(path)
+    self.hashes: dict[str, dict[str, object]] = {}
+    self.entries: dict[str, dict[str, tuple[int, int, int, str]]] = {}
+    self._file = self.path.open("wb")
+    self._file.write(PACK_HEADER.pack(PACK_MAGIC, 0, 0))
+
+  def write(self, path: str, data: bytes) -> None:
+    sha = hashlib.sha256(data).hexdigest()
+    self.hashes[path] = {"sha256": sha, "size": len(data)}
+    source, encoding = path, "identity"
+    for enc, suffix in COMPRESSED_SUFFIX.items():
+      if path.endswith(suffix) and path[: -len(suffix)] in self.entries:
+        source, encoding = path[: -len(suffix)], enc
+    etag = sha[:32]
+    head = response_head(source, len(data), encoding, etag)
+    offset = self._file.tell()
+    self._file.write(head)
+    self._file.write(data)
+    self.entries.setdefault(source, {})[encoding] = (offset, len(head), len(data), etag)
+
+  def close(self) -> None:
+    if self._file.closed:
+      return
+    index = json.dumps(
+      {
+        "version": PACK_VERSION,
+        "site_origin": CONFIG.site_origin,
+        "subdomain_base": CONFIG.subdomain_base,
+        "city_slug_re": city_slug_re(get_cities()),
+        "entries": self.entries,
+        "files": self.hashes,
+      },
+      sort_keys=True,
+      separators=(",", ":"),
+    ).encode("utf-8")
+    offset = self._file.tell()
+    self._file.write(index)
+    self._file.seek(0)
+    self._file.write(PACK_HEADER.pack(PACK_MAGIC, offset, len(index)))
+    self._file.close()
+
+
+def read_pack_index(buf) -> dict:
+  """
+  Index of a .pack file, from its bytes or an mmap of it.
+  """
+  magic, offset, length = PACK_HEADER.unpack_from(buf, 0)
+  if magic != PACK_MAGIC:
+    raise ValueError("Not a site pack file")
+  index = json.loads(bytes(buf[offset:offset + length]))
+  if index.get("version") != PACK_VERSION:
+    raise ValueError(f"Unsupported site pack version: {index.get('version')}")
+  return index
+
 
-  write_text(out / "robots.txt", robots_txt())
-  write_text(out / "sitemap.xml", sitemap_xml(urls))
-  write_text(script_dir / "wrangler.jsonc", wrangler_content())
+def write_bundle(path: Path, *, compress: bool = False) -> ArchiveSink | PackSink:
+  """
+  --bundle: stream the active site straight into one archive (no public/
+  tree), optionally with .gz/.br siblings like --compress. A .pack path
+  writes a PackSink instead.
+  """
+  bundle = PackSink(path) if Path(path).name.endswith(".pack") else ArchiveSink(path)
+  try:
+    for out_path, data in site_files(get_cities()):
+      bundle.write(out_path, data)
+      if compress and Path(out_path).suffix in COMPRESSIBLE_SUFFIXES:
+        for enc in available_encodings():
+          bundle.write(out_path + COMPRESSED_SUFFIX[enc], compress_bytes(data, enc))
+  finally:
+    bundle.close()
+  return bundle
+
+
+# -----------------------
+# REPRODUCIBLE BUILDS
+# -----------------------
+def input_paths() -> list[Path]:
+  return [CONFIG.cities_csv, source_image_path(), Path(__file__).resolve()]
+
+
+def inputs_last_changed() -> str:
+  """
+  Date of the last commit touching the build inputs (CSV, image, generator),
+  falling back to their newest mtime outside a git checkout.
+  """
+  paths = [path.resolve() for path in input_paths()]
+  try:
+    out = subprocess.run(
+      ["git", "log", "-1", "--format=%cs", "--", *map(str, paths)],
+      cwd=Path(__file__).resolve().parent, capture_output=True, text=True, check=True,
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    out = ""
+  if out:
+    return out
+  newest = max(path.stat().st_mtime for path in paths if path.exists())
+  return datetime.fromtimestamp(newest, timezone.utc).date().isoformat()
+
+
+def resolve_build_date(spec: str | None) -> str | None:
+  """
+  --build-date value (YYYY-MM-DD or "auto") -> pinned date; without one,
+  SOURCE_DATE_EPOCH is honoured. None means "today" (not reproducible).
+  """
+  if spec == "auto":
+    return inputs_last_changed()
+  if spec:
+    return date.fromisoformat(spec).isoformat()
+  epoch = os.getenv("SOURCE_DATE_EPOCH")
+  if epoch:
+    return datetime.fromtimestamp(int(epoch), timezone.utc).date().isoformat()
+  return None
+
+
+def work_dir_paths(work_dir: Path) -> dict[str, Path]:
+  """
+  SiteConfig path overrides that keep every file a build writes under work_dir.
+  """
+  return {
+    "output_dir": work_dir / CONFIG.output_dir.name,
+    "manifest_path": work_dir / CONFIG.manifest_path.name,
+    "wrangler_path": work_dir / CONFIG.wrangler_path.name,
+    "vercel_path": work_dir / CONFIG.vercel_path.name,
+    "cloudflare_rules_path": work_dir / CONFIG.cloudflare_rules_path.name,
+  }
+
+
+def tree_hashes(root: Path) -> dict[str, str]:
+  """
+  {path relative to root: sha256} for every file under root.
+  """
+  return {
+    path.relative_to(root).as_posix(): hashlib.sha256(path.read_bytes()).hexdigest()
+    for path in sorted(root.rglob("*")) if path.is_file()
+  }
+
+
+def verify_reproducible(args: argparse.Namespace) -> list[str]:
+  """
+  Run two --full builds in fresh interpreters (different hash seeds) into
+  temporary work dirs and return the paths whose bytes differ across the
+  output trees, wrangler.jsonc and the host configs; [] means reproducible.
+  """
+  argv = ["--full", "--build-date", CONFIG.build_day()]
+  flags = (
+    "external_css", "prune_css", "minify", "networx_facade", "cloudflare_headers", "responsive_images", "compress"
+  )
+  for flag in flags:
+    if getattr(args, flag):
+      argv.append("--" + flag.replace("_", "-"))
+
+  with tempfile.TemporaryDirectory() as tmp:
+    builds = []
+    for seed in ("1", "2"):
+      work_dir = Path(tmp) / f"build-{seed}"
+      subprocess.run(
+        [sys.executable, str(Path(__file__).resolve()), *argv, "--work-dir", str(work_dir)],
+        env={**os.environ, "PYTHONHASHSEED": seed}, stdout=subprocess.DEVNULL, check=True,
+      )
+      paths = work_dir_paths(work_dir)
+      hashes = {
+        f"{paths['output_dir'].name}/{path}": sha for path, sha in tree_hashes(paths["output_dir"]).items()
+      }
+      for key in ("wrangler_path", "vercel_path", "cloudflare_rules_path"):
+        hashes[paths[key].name] = hashlib.sha256(paths[key].read_bytes()).hexdigest()
+      builds.append(hashes)
+  first, second = builds
+  return sorted(path for path in first.keys() | second.keys() if first.get(path) != second.get(path))
+
+
+# -----------------------
+# DEPLOY DELTA
+# -----------------------
+DEPLOY_MANIFEST_VERSION = 1
+
+
+def deploy_state(hashes: dict[str, str], urls: dict[str, str]) -> dict[str, dict[str, str]]:
+  """
+  {path: {"sha256": ..., "url": canonical URL (pages only)}} for a finished build.
+  """
+  state = {}
+  for path, sha in hashes.items():
+    state[path] = {"sha256": sha, "url": urls[path]} if path in urls else {"sha256": sha}
+  return state
+
+
+def load_deploy_manifest(path: Path) -> dict[str, dict[str, str]]:
+  try:
+    data = json.loads(path.read_text(encoding="utf-8"))
+  except (FileNotFoundError, ValueError):
+    return {}
+  if data.get("version") != DEPLOY_MANIFEST_VERSION:
+    return {}
+  return data.get("files", {})
+
+
+def save_deploy_manifest(path: Path, state: dict[str, dict[str, str]]) -> None:
+  tmp = path.with_name(path.name + ".tmp")
+  tmp.write_text(
+    json.dumps({"version": DEPLOY_MANIFEST_VERSION, "files": state}, indent=1, sort_keys=True),
+    encoding="utf-8",
+  )
+  os.replace(tmp, path)
+
+
+def deploy_delta(deployed: dict[str, dict[str, str]], current: dict[str, dict[str, str]]) -> dict[str, list[str]]:
+  """
+  Files to upload/delete since the last deploy, plus the canonical URLs of
+  every added, changed or removed page (for search-engine change pings).
+  """
+  added = sorted(current.keys() - deployed.keys())
+  removed = sorted(deployed.keys() - current.keys())
+  changed = sorted(
+    path for path in current.keys() & deployed.keys()
+    if current[path]["sha256"] != deployed[path]["sha256"]
+  )
+  urls = {current[path].get("url") for path in added + changed}
+  urls |= {deployed[path].get("url") for path in removed}
+  urls.discard(None)
+  return {"added": added, "changed": changed, "removed": removed, "changed_urls": sorted(urls)}
+
+
+def bundle_hashes(archive: Path) -> dict[str, str]:
+  """
+  File hashes recorded in a --bundle archive's manifest member.
+  """
+  if archive.name.endswith(".pack"):
+    with archive.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+      files = read_pack_index(buf)["files"]
+    return {path: entry["sha256"] for path, entry in files.items()}
+  if archive.name.endswith(".zip"):
+    with zipfile.ZipFile(archive) as zf:
+      raw = zf.read(BUNDLE_MANIFEST)
+  else:
+    with tarfile.open(archive) as tf:
+      raw = tf.extractfile(BUNDLE_MANIFEST).read()
+  return {path: entry["sha256"] for path, entry in json.loads(raw)["files"].items()}
+
+
+def print_deploy_delta(out_path: Path, delta: dict[str, list[str]]) -> None:
+  print(
+    f"✅ Deploy delta: {len(delta['added'])} added, {len(delta['changed'])} changed, "
+    f"{len(delta['removed'])} removed, {len(delta['changed_urls'])} URLs -> {out_path}"
+  )
+
+
+def write_deploy_delta(out_path: Path, current: dict[str, dict[str, str]]) -> dict[str, list[str]]:
+  delta = deploy_delta(load_deploy_manifest(CONFIG.deploy_manifest_path), current)
+  out_path.write_text(json.dumps(delta, indent=1) + "\n", encoding="utf-8")
+  return delta
+
+
+# -----------------------
+# PROFILING
+# -----------------------
+class BuildProfiler:
+  """
+  --profile: wall time and tracemalloc peak per build stage, plus an optional
+  cProfile dump (pstats format; open with snakeviz, or flameprof/gprof2dot
+  for a flamegraph). Disabled, stage() only costs a context manager.
+  """
+
+  def __init__(self, *, enabled: bool = False, cprofile_path: Path | None = None) -> None:
+    self.enabled = enabled or cprofile_path is not None
+    self.cprofile_path = cprofile_path
+    self.stages: list[tuple[str, float, int]] = []  # (name, seconds, peak bytes)
+    self._profile = cProfile.Profile() if cprofile_path is not None else None
+
+  def start(self) -> None:
+    if self.enabled:
+      tracemalloc.start()
+    if self._profile is not None:
+      self._profile.enable()
+
+  @contextmanager
+  def stage(self, name: str):
+    if not self.enabled:
+      yield
+      return
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.stages.append((name, time.perf_counter() - start, tracemalloc.get_traced_memory()[1]))
+
+  def stop(self) -> None:
+    if self._profile is not None:
+      self._profile.disable()
+      self._profile.dump_stats(self.cprofile_path)
+    if self.enabled:
+      tracemalloc.stop()
+
+  def report(self, build: IncrementalBuild | None = None) -> str:
+    total = sum(seconds for _, seconds, _ in self.stages)
+    lines = ["⏱ Build profile (stage, wall, share, peak traced memory):"]
+    for name, seconds, peak in self.stages:
+      share = seconds / total * 100 if total else 0.0
+      lines.append(f"  {name:<12} {seconds * 1000:9.1f} ms  {share:5.1f}%  {peak / 1024:9.1f} KiB")
+    if build is not None:
+      lines.append(
+        f"  pages: render {build.render_s * 1000:.1f} ms, write {build.write_s * 1000:.1f} ms"
+        " (summed over workers)"
+      )
+    if self.cprofile_path is not None:
+      lines.append(f"  cProfile stats: {self.cprofile_path}")
+    return "\n".join(lines)
+
+
+# -----------------------
+# MAIN
+# -----------------------
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description="Generate the static site into CONFIG.output_dir.")
+  parser.add_argument(
+    "--full",
+    action="store_true",
+    help="ignore the build manifest and regenerate every file from scratch",
+  )
+  parser.add_argument(
+    "--jobs", "-j",
+    type=int,
+    default=1,
+    metavar="N",
+    help="render pages in N worker processes (0 = one per CPU core)",
+  )
+  parser.add_argument(
+    "--external-css",
+    action="store_true",
+    help="write /assets/site.<hash>.css once and link it instead of inlining CSS in every page",
+  )
+  parser.add_argument(
+    "--prune-css",
+    action="store_true",
+    help="inline only the CSS rules each page's HTML can match (per page type) instead of the whole stylesheet",
+  )
+  parser.add_argument(
+    "--minify",
+    action="store_true",
+    help="collapse insignificant whitespace, strip CSS comments and shorten tags/attributes (same rendering)",
+  )
+  parser.add_argument(
+    "--networx-facade",
+    action="store_true",
+    help="contact page: static placeholder that loads the Networx form (/contact/form/) on click",
+  )
+  parser.add_argument(
+    "--cloudflare-headers",
+    action="store_true",
+    help="write <output_dir>/_headers with the cache policy for Cloudflare static assets "
+    "(leave off for Vercel, which would publish it)",
+  )
+  parser.add_argument(
+    "--responsive-images",
+    action="store_true",
+    help="emit resized AVIF/WebP/JPEG derivatives of the site image with <picture>/srcset (needs Pillow)",
+  )
+  parser.add_argument(
+    "--compress",
+    action="store_true",
+    help="write max-compression .gz (and .br, if brotli is installed) siblings for HTML/XML/CSS/TXT",
+  )
+  parser.add_argument(
+    "--profile",
+    action="store_true",
+    help="print per-stage wall time and tracemalloc peak, plus page render vs write time",
+  )
+  parser.add_argument(
+    "--profile-out",
+    type=Path,
+    metavar="FILE",
+    help="also dump cProfile stats (pstats format) to FILE; implies --profile",
+  )
+  parser.add_argument(
+    "--bundle",
+    type=Path,
+    metavar="ARCHIVE",
+    help="write the site straight into ARCHIVE (.zip, .tar, .tar.gz, or .pack for packserver.py) "
+    "with a hash manifest, skipping output_dir",
+  )
+  parser.add_argument(
+    "--build-date",
+    metavar="YYYY-MM-DD|auto",
+    help="pin the date stamped into sitemaps and wrangler.jsonc ('auto' = last change to the inputs); "
+    "defaults to SOURCE_DATE_EPOCH, else today",
+  )
+  parser.add_argument(
+    "--verify-reproducible",
+    action="store_true",
+    help="run two --full builds into temporary --work-dirs and fail unless the output trees, "
+    "wrangler.jsonc and the host configs are byte-identical",
+  )
+  parser.add_argument(
+    "--work-dir",
+    type=Path,
+    metavar="DIR",
+    help="write the output, build manifest, wrangler.jsonc and host configs under DIR instead",
+  )
+  parser.add_argument(
+    "--deploy-delta",
+    type=Path,
+    metavar="FILE",
+    help="write added/changed/removed files and changed canonical URLs vs the last deploy to FILE (JSON)",
+  )
+  parser.add_argument(
+    "--mark-deployed",
+    action="store_true",
+    help="record the last build (or the --bundle archive) as deployed, then exit",
+  )
+  parser.add_argument(
+    "--in-place",
+    action="store_true",
+    help="update output_dir directly instead of staging and swapping (fast local rebuilds, not atomic)",
+  )
+  parser.add_argument(
+    "--keep-previous",
+    action="store_true",
+    help="keep the replaced build as <output_dir>.prev for instant --rollback",
+  )
+  parser.add_argument(
+    "--rollback",
+    action="store_true",
+    help="swap the live output with the build kept by --keep-previous, then exit",
+  )
+  args = parser.parse_args(argv)
+  if args.in_place and args.keep_previous:
+    parser.error("--in-place cannot be combined with --keep-previous")
+  if args.prune_css and args.external_css:
+    parser.error("--prune-css applies to inlined CSS; it cannot be combined with --external-css")
+  return args
+
+
+def main(argv: list[str] | None = None) -> None:
+  args = parse_args(argv)
+  overrides = {}
+  if args.external_css:
+    overrides["external_css"] = True
+  if args.responsive_images:
+    overrides["responsive_images"] = True
+  if args.prune_css:
+    overrides["prune_css"] = True
+  if args.minify:
+    overrides["minify"] = True
+  if args.networx_facade:
+    overrides["networx_facade"] = True
+  if args.cloudflare_headers:
+    overrides["cloudflare_headers"] = True
+  if args.work_dir:
+    overrides.update(work_dir_paths(args.work_dir))
+  build_date = resolve_build_date(args.build_date)
+  if build_date:
+    overrides["build_date"] = build_date
+  if overrides:
+    set_site(replace(CONFIG, **overrides))
+
+  out = CONFIG.output_dir
+  if args.rollback:
+    rollback(out, CONFIG.manifest_path)
+    print(f"✅ Rolled back: {out.resolve()} <-> {previous_build_paths(out, CONFIG.manifest_path)[0]}")
+    return
+
+  if args.verify_reproducible:
+    diff = verify_reproducible(args)
+    if diff:
+      print(f"❌ Not reproducible ({len(diff)} files differ): " + ", ".join(diff[:10]))
+      raise SystemExit(1)
+    print(f"✅ Reproducible: two builds dated {CONFIG.build_day()} are byte-identical")
+    return
+
+  prof = BuildProfiler(enabled=args.profile, cprofile_path=args.profile_out)
+  prof.start()
+
+  with prof.stage("csv"):
+    set_site(CONFIG, CONFIG.load_cities())
+
+  if args.mark_deployed:
+    if args.bundle:
+      hashes = bundle_hashes(args.bundle)
+    else:
+      hashes = {path: entry["output"] for path, entry in load_manifest(CONFIG.manifest_path).items()}
+    urls = {job.path: job.url for job in site_pages(get_cities())}
+    save_deploy_manifest(CONFIG.deploy_manifest_path, deploy_state(hashes, urls))
+    print(f"✅ Marked {len(hashes)} files as deployed: {CONFIG.deploy_manifest_path}")
+    return
+
+  if args.bundle:
+    with prof.stage("bundle"):
+      bundle = write_bundle(args.bundle, compress=args.compress)
+    prof.stop()
+    print(f"✅ Bundled {len(bundle.hashes)} files into: {args.bundle.resolve()}")
+    if args.deploy_delta:
+      urls = {job.path: job.url for job in site_pages(get_cities())}
+      hashes = {path: entry["sha256"] for path, entry in bundle.hashes.items()}
+      print_deploy_delta(args.deploy_delta, write_deploy_delta(args.deploy_delta, deploy_state(hashes, urls)))
+    if prof.enabled:
+      print(prof.report())
+    return
+
+  with prof.stage("manifest"):
+    build = IncrementalBuild(
+      out, CONFIG.manifest_path, full=args.full, keep_previous=args.keep_previous, in_place=args.in_place
+    )
+
+  with prof.stage("image"):
+    # Shared image (+ derivatives, stylesheet) into /public/
+    for path, src in site_assets():
+      if isinstance(src, Path):
+        build.copy(path, src)
+      else:
+        build.write(path, src)
+    if CONFIG.responsive_images and current_image_set() is None:
+      print("⚠️ Pillow (with JPEG support) not installed: serving the original image only")
+
+  with prof.stage("nearby"):
+    neighbors = {} if args.full else load_manifest(CONFIG.manifest_path, "neighbors")
+    nearby, neighbors, recomputed = nearby_cities(get_cities(), CONFIG.nearby_count, neighbors)
+    if neighbors:
+      build.sections["neighbors"] = neighbors
+
+  workers = args.jobs or os.cpu_count() or 1
+  with prof.stage("core pages"):
+    jobs = site_pages(get_cities(), nearby)
+    build.pages([job for job in jobs if job.kind not in ("city", "city_cost")], workers=workers)
+
+  with prof.stage("city pages"):
+    build.pages([job for job in jobs if job.kind in ("city", "city_cost")], workers=workers)
+
+  with prof.stage("sitemap"):
+    # Sitemap (every page, in build order):
+    # - root pages absolute on apex
+    # - city + city cost pages absolute subdomains
+    sitemap = SitemapWriter(build)
+    for job in jobs:
+      if job.kind not in SITEMAP_EXCLUDED_KINDS:
+        sitemap.add(job.url, build.files[job.path]["lastmod"])
+    sitemap.close()
+
+  with prof.stage("robots"):
+    build.write("robots.txt", robots_txt())
+
+  with prof.stage("host config"):
+    for path, text in host_files():
+      build.write(path, text)
+
+  if args.compress:
+    with prof.stage("compress"):
+      if brotli is None:
+        print("⚠️ brotli not installed: writing .gz siblings only")
+      build.compress(workers=workers)
+
+  with prof.stage("swap"):
+    build.finish()
+
+  with prof.stage("wrangler"):
+    write_text(CONFIG.wrangler_path, wrangler_content())
+    host_configs = (
+      (CONFIG.vercel_path, vercel_json(get_cities(), jobs), "commit it, Vercel reads the committed copy"),
+      (CONFIG.cloudflare_rules_path, cloudflare_rules_json(get_cities(), jobs), "apply it to the Cloudflare zone"),
+    )
+    for path, text, action in host_configs:
+      if not path.exists() or path.read_text(encoding="utf-8") != text:
+        write_text(path, text)
+        print(f"⚠️ {path.name} changed: {action}")
+
+  if args.deploy_delta:
+    with prof.stage("delta"):
+      hashes = {path: entry["output"] for path, entry in build.files.items()}
+      delta = write_deploy_delta(args.deploy_delta, deploy_state(hashes, {job.path: job.url for job in jobs}))
+
+  prof.stop()
 
   print(f"✅ Generated site into: {out.resolve()}")
+  print(f"✅ Files: {build.written} written, {build.unchanged} unchanged, {build.pruned} pruned")
+  if build.fragment_stats:
+    print("✅ Fragment cache: " + ", ".join(
+      f"{name} {hits} hits/{misses} misses" for name, (hits, misses) in build.fragment_stats.items()
+    ))
+  if CONFIG.prune_css:
+    print("✅ Pruned CSS bytes per page: " + ", ".join(
+      f"{kind} {full}→{pruned}" for kind, (full, pruned) in css_savings(jobs).items()
+    ))
+  if CONFIG.minify:
+    print("✅ Minified HTML bytes per page: " + ", ".join(
+      f"{kind} {before}→{after}" for kind, (before, after) in minify_savings(jobs).items()
+    ))
+  if neighbors:
+    print(f"✅ Nearby cities: {recomputed} lists recomputed, {len(neighbors) - recomputed} cached")
   print(f"✅ SITE_ORIGIN={CONFIG.site_origin}")
   print(f"✅ SUBDOMAIN_BASE={CONFIG.subdomain_base}")
+  if args.deploy_delta:
+    print_deploy_delta(args.deploy_delta, delta)
+  if prof.enabled:
+    print(prof.report(build))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Tiny static server for a site pack (load testing, self-hosting fallback).
+
+  python3 generate.py --bundle site.pack --compress
+  python3 packserver.py site.pack --port 8080 --workers 4
+
+The pack is memory-mapped and its index loaded once. Each entry is a complete
+HTTP/1.1 response, so a GET is a dict lookup plus one zero-copy sendfile() of
+that byte range (HEAD sends just the headers from the mmap). Hosts route like
+vercel.json: www.<apex> and apex /<slug>/... answer 308 to the apex and the
+city subdomain; <slug>.<SUBDOMAIN_BASE> (or <slug>.localhost) serves /<slug>/.
+The .br/.gz variant is picked from Accept-Encoding, and a request whose
+If-None-Match holds that variant's ETag gets a canned 304. With --workers N, N
+processes share the port through SO_REUSEPORT and the kernel balances them.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+import argparse
+import asyncio
+import mmap
+import multiprocessing
+import os
+
+import generate
+
+ENCODINGS = ("br", "gzip")  # preference order; "identity" is always present
+MAX_HEAD = 16 * 1024
+
+
+def canned(status: str, extra: str = "") -> bytes:
+  return f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n{extra}\r\n".encode("ascii")
+
+
+NOT_FOUND = canned("404 Not Found")
+BAD_REQUEST = canned("400 Bad Request", "Connection: close\r\n")
+NOT_ALLOWED = canned("405 Method Not Allowed", "Allow: GET, HEAD\r\n")
+
+
+class Pack:
+  def __init__(self, path: Path) -> None:
+    self.file = path.open("rb")
+    self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    index = generate.read_pack_index(self.map)
+    self.site_origin = index["site_origin"]
+    self.subdomain_base = index["subdomain_base"]
+    self.city_slug_re = index["city_slug_re"]
+    self.entries = {
+      path: {enc: (offset, head_len, body_len) for enc, (offset, head_len, body_len, _) in variants.items()}
+      for path, variants in index["entries"].items()
+    }
+    # Per variant: the quoted ETag and the canned 304 sent when it matches.
+    self.etags = {
+      path: {enc: (f'"{entry[3]}"', generate.not_modified_head(path, entry[3])) for enc, entry in variants.items()}
+      for path, variants in index["entries"].items()
+    }
+
+  def lookup(
+    self, host: str, target: str, accept_encoding: str, if_none_match: str = ""
+  ) -> tuple[int, int, int] | bytes:
+    """
+    (offset, head_len, body_len) of the response to send, or a canned response.
+    """
+    location = generate.host_redirect(host, target, self.city_slug_re, self.site_origin, self.subdomain_base)
+    if location is not None:
+      return canned("308 Permanent Redirect", f"Location: {location}\r\n")
+    url_path = unquote(urlsplit(target).path)
+    rel = generate.tree_path(generate.route_host(host, url_path, self.subdomain_base))
+    variants = self.entries.get(rel)
+    if variants is None:
+      if not url_path.endswith("/") and rel + "/index.html" in self.entries:
+        return canned("308 Permanent Redirect", f"Location: {url_path}/\r\n")
+      return NOT_FOUND
+    encoding = "identity"
+    if len(variants) > 1:
+      accepted = generate.accepted_encodings(accept_encoding)
+      encoding = next((enc for enc in ENCODINGS if enc in variants and enc in accepted), "identity")
+    if if_none_match:
+      etag, not_modified = self.etags[rel][encoding]
+      if etag_matches(if_none_match, etag):
+        return not_modified
+    return variants[encoding]
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+  """
+  If-None-Match uses weak comparison: W/ prefixes are ignored, * matches all.
+  """
+  if if_none_match.strip() == "*":
+    return True
+  return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def parse_head(raw: bytes) -> tuple[str, str, str, dict[str, str]] | None:
+  try:
+    lines = raw.decode("latin-1").split("\r\n")
+    method, target, version = lines[0].split(" ")
+  except ValueError:
+    return None
+  headers = {}
+  for line in lines[1:]:
+    name, sep, value = line.partition(":")
+    if sep:
+      headers[name.strip().lower()] = value.strip()
+  return method, target, version, headers
+
+
+async def handle(pack: Pack, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+  loop = asyncio.get_running_loop()
+  try:
+    while True:
+      try:
+        raw = await reader.readuntil(b"\r\n\r\n")
+      except asyncio.LimitOverrunError:
+        writer.write(BAD_REQUEST)
+        break
+      except asyncio.IncompleteReadError:
+        break
+      request = parse_head(raw[:-4])
+      if request is None:
+        writer.write(BAD_REQUEST)
+        break
+      method, target, version, headers = request
+
+      if method not in ("GET", "HEAD"):
+        writer.write(NOT_ALLOWED)
+      else:
+        found = pack.lookup(
+          headers.get("host", ""), target, headers.get("accept-encoding", ""), headers.get("if-none-match", "")
+        )
+        if isinstance(found, bytes):
+          writer.write(found)
+        elif method == "HEAD":
+          offset, head_len, _ = found
+          writer.write(pack.map[offset:offset + head_len])
+        else:
+          offset, head_len, body_len = found
+          await writer.drain()
+          await loop.sendfile(writer.transport, pack.file, offset, head_len + body_len)
+
+      connection = headers.get("connection", "").lower()
+      if connection == "close" or (version == "HTTP/1.0" and connection != "keep-alive"):
+        break
+    await writer.drain()
+  except (ConnectionError, OSError):
+    pass
+  finally:
+    writer.close()
+
+
+async def serve(pack_path: Path, host: str, port: int, reuse_port: bool) -> None:
+  pack = Pack(pack_path)
+  server = await asyncio.start_server(
+    lambda r, w: handle(pack, r, w), host, port, reuse_port=reuse_port, limit=MAX_HEAD, backlog=1024
+  )
+  async with server:
+    await server.serve_forever()
+
+
+def run_worker(pack_path: Path, host: str, port: int, reuse_port: bool) -> None:
+  try:
+    asyncio.run(serve(pack_path, host, port, reuse_port))
+  except KeyboardInterrupt:
+    pass
+
+
+def main(argv: list[str] | None = None) -> None:
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("pack", type=Path, help="file written by generate.py --bundle site.pack")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8080)
+  parser.add_argument(
+    "--workers", type=int, default=1, metavar="N", help="processes sharing the port via SO_REUSEPORT (0 = one per core)"
+  )
+  args = parser.parse_args(argv)
+
+  workers = args.workers or os.cpu_count() or 1
+  pages = len(Pack(args.pack).entries)
+  print(f"✅ Serving {pages} paths from {args.pack.resolve()} on http://{args.host}:{args.port}/ ({workers} workers)")
+  if workers == 1:
+    run_worker(args.pack, args.host, args.port, False)
+    return
+
+  procs = [
+    multiprocessing.Process(target=run_worker, args=(args.pack, args.host, args.port, True))
+    for _ in range(workers)
+  ]
+  for proc in procs:
+    proc.start()
+  try:
+    for proc in procs:
+      proc.join()
+  except KeyboardInterrupt:
+    for proc in procs:
+      proc.terminate()
+
+
+if __name__ == "__main__":
+  main()